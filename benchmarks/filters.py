@@ -0,0 +1,86 @@
+"""
+Per-message cost of rewriting jobs with [[filters]] as the number of rules
+grows, one rule per mailbox like a generated config would have.
+
+    python benchmarks/filters.py [--rules 10,100,1000] [--messages 2000]
+
+Compares the linear re.sub loop the filters used to be applied with, the
+indexed filter table and the indexed table with its rewrite cache.
+"""
+
+import argparse
+import random
+import re
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from throttle_cli.filters import Filters  # noqa: E402
+
+
+def make_filters(n):
+    filters = [
+        {
+            "pattern": rf"^mbsync acct{i}-(?!(inbox|archive|sent|drafts)$).+",
+            "substitute": rf"mbsync acct{i}-folders",
+        }
+        for i in range(n)
+    ]
+    filters.append({"pattern": r"^sleep \d$", "substitute": "sleep 10"})
+    return filters
+
+
+def make_jobs(n, count):
+    rng = random.Random(0)
+    folders = ["inbox", "archive", "lists", "work", "receipts"]
+    jobs = [
+        f"mbsync acct{rng.randrange(n)}-{rng.choice(folders)}" for _ in range(count)
+    ]
+    return jobs + ["notmuch new"] * (count // 10)
+
+
+def linear(filters):
+    def rewrite(job):
+        for item in filters:
+            newjob = re.sub(item["pattern"], item["substitute"], job)
+            if newjob != job:
+                return newjob
+        return job
+
+    return rewrite
+
+
+def bench(rewrite, jobs, repeat):
+    best = min(
+        timeit.repeat(lambda: [rewrite(job) for job in jobs], number=1, repeat=repeat)
+    )
+    return best / len(jobs) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rules", default="10,100,1000")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'rules':>6} {'linear (us)':>12} {'indexed (us)':>13} {'cached (us)':>12}")
+    for n in map(int, args.rules.split(",")):
+        filters = make_filters(n)
+        jobs = make_jobs(n, args.messages)
+        table = Filters(filters)
+        # re's own pattern cache only holds 512 patterns, so this gets slow
+        sample = jobs[: max(20, args.messages // n)]
+        for job in sample:
+            assert table.rewrite(job) == linear(filters)(job)
+        table.rewrite.cache_clear()
+        lin = bench(linear(filters), sample, 1)
+        uncached = bench(table._rewrite, jobs, args.repeat)
+        cached = bench(table.rewrite, jobs, args.repeat)
+        print(f"{n:>6} {lin:>12.2f} {uncached:>13.2f} {cached:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Throughput, coalescing and memory of a throttle server under load.
+
+    python benchmarks/load.py [--clients 8] [--jobs 20] [--chain 1]
+        [--triggers 200] [--command sleep] [--engine process]
+        [--json results.json] [--compare baseline.json]
+
+Starts throttle-server against temporary XDG directories and has --clients
+concurrent clients send --triggers triggers each, every one a chain of
+--chain jobs picked from --jobs distinct stub commands (sleep, true or false).
+Reports the submit throughput, trigger to start latency percentiles (from the
+started events of a watching client), how many triggers were coalesced, the
+peak number of workers and the peak RSS and PSS of the server and its
+workers. With --json the results are written as JSON, which --compare takes
+to show the change against an earlier run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from throttle_cli.ipc import Client  # noqa: E402
+
+COMMANDS = {
+    "sleep": "sh -c 'sleep {sleep}' job{i}",
+    "true": "true job{i}",
+    "false": "false job{i}",
+}
+
+
+def start_server(tmp, engine, config):
+    env = dict(
+        os.environ,
+        XDG_RUNTIME_DIR=str(tmp / "run"),
+        XDG_STATE_HOME=str(tmp / "state"),
+        XDG_CONFIG_HOME=str(tmp / "config"),
+    )
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(ROOT), env.get("PYTHONPATH")])
+    )
+    (tmp / "run").mkdir()
+    (tmp / "config" / "throttle").mkdir(parents=True)
+    (tmp / "config" / "throttle" / "config.toml").write_text(config)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "throttle_cli.cli_server", "--engine", engine],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    socketpath = tmp / "run" / "throttle.sock"
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            Client(socketpath).close()
+            return proc, socketpath
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("the server didn't come up")
+
+
+def tree_memory(pid):
+    """
+    RSS and PSS in bytes of a process and all of its descendants, from /proc.
+    The workers are forked, so the RSS counts the pages they share with the
+    server once for each of them, the PSS splits them between them.
+    """
+    children = {}
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # the command name in parentheses can contain spaces
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+    rss = pss = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        pending += children.get(current, [])
+        try:
+            with open(f"/proc/{current}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1]) * 1024
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return rss, pss
+
+
+class Sampler(threading.Thread):
+    """
+    Polls the status and memory of the server until stopped.
+    """
+
+    def __init__(self, socketpath, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.socketpath = socketpath
+        self.pid = pid
+        self.interval = interval
+        self.workers = 0
+        self.rss = 0
+        self.pss = 0
+        self.status = {}
+        self.total = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        with Client(self.socketpath) as client:
+            while not self.stopped.is_set():
+                self.status = client.call("info", {"action": "STATUS"})
+                stats = client.call("info", {"action": "STATS"})
+                self.total = sum(job["total"] for job in stats["jobs"].values())
+                self.workers = max(self.workers, len(self.status))
+                if sys.platform == "linux":
+                    rss, pss = tree_memory(self.pid)
+                    self.rss = max(self.rss, rss)
+                    self.pss = max(self.pss, pss)
+                self.stopped.wait(self.interval)
+
+
+class Watcher(threading.Thread):
+    """
+    Collects how long after its trigger each run started.
+    """
+
+    def __init__(self, socketpath):
+        super().__init__(daemon=True)
+        self.client = Client(socketpath)
+        self.client.call("watch", None)
+        self.waits = []
+
+    def run(self):
+        try:
+            for event in self.client.events():
+                if event["event"] == "started" and "wait" in event:
+                    self.waits.append(event["wait"])
+        except (ConnectionError, OSError, ValueError):
+            pass
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--chain", type=int, default=1)
+    parser.add_argument("--triggers", type=int, default=200, help="per client")
+    parser.add_argument("--command", choices=COMMANDS, default="sleep")
+    parser.add_argument("--sleep", type=float, default=0.05)
+    parser.add_argument("--engine", choices=("process", "asyncio"), default="process")
+    parser.add_argument("--config", type=Path, help="config.toml to run with")
+    parser.add_argument("--settle", type=float, default=60, help="max seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="write the results here")
+    parser.add_argument("--compare", type=Path, help="results of an earlier run")
+    args = parser.parse_args()
+
+    config = args.config.read_text() if args.config else "retry_sequence = [60]\n"
+    jobs = [
+        COMMANDS[args.command].format(i=i, sleep=args.sleep) for i in range(args.jobs)
+    ]
+    rng = random.Random(args.seed)
+    chains = [
+        [[rng.choice(jobs) for _ in range(args.chain)] for _ in range(args.triggers)]
+        for _ in range(args.clients)
+    ]
+
+    tmp = Path(tempfile.mkdtemp())
+    server, socketpath = start_server(tmp, args.engine, config)
+    try:
+        watcher = Watcher(socketpath)
+        watcher.start()
+        sampler = Sampler(socketpath, server.pid)
+        sampler.start()
+        baseline_rss, baseline_pss = (
+            tree_memory(server.pid) if sys.platform == "linux" else (0, 0)
+        )
+
+        submit_times = []
+
+        def client(chains):
+            with Client(socketpath) as c:
+                for chain in chains:
+                    start = time.perf_counter()
+                    c.handle(
+                        {
+                            "action": "RUN",
+                            "jobs": chain,
+                            "notifications": [0] * len(chain),
+                        }
+                    )
+                    submit_times.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client, args=(c,)) for c in chains]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        submitted = time.perf_counter() - start
+
+        # wait for every trigger to have been handled and every run to have
+        # started
+        deadline = time.monotonic() + args.settle
+        seen = -1
+        while time.monotonic() < deadline:
+            time.sleep(0.5)
+            quiet = not any(
+                item["state"] not in ("idle", "running")
+                # failing runs are retried for good, whatever is queued
+                # behind them doesn't start
+                or (item["queuesize"] and args.command != "false")
+                for item in sampler.status.values()
+            )
+            if quiet and sampler.total == seen:
+                break
+            seen = sampler.total
+        settled = time.perf_counter() - start
+        time.sleep(0.3)
+        with Client(socketpath) as c:
+            stats = c.call("info", {"action": "STATS"})
+        sampler.stopped.set()
+        sampler.join()
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    triggers = args.clients * args.triggers * args.chain
+    total = sum(job["total"] for job in stats["jobs"].values())
+    runs = sum(job["run"] for job in stats["jobs"].values())
+    results = {
+        "params": {
+            key: str(value) if isinstance(value, Path) else value
+            for key, value in vars(args).items()
+            if key not in ("json", "compare")
+        },
+        "python": platform.python_version(),
+        "submit_per_s": args.clients * args.triggers / submitted,
+        "submit_p50_ms": statistics.median(submit_times) * 1000,
+        "submit_p99_ms": percentile(submit_times, 0.99) * 1000,
+        "settle_s": settled,
+        "triggers": triggers,
+        "triggers_seen": total,
+        "runs": runs,
+        "coalescing_ratio": 1 - runs / total if total else 0,
+        "wait_p50_ms": (percentile(watcher.waits, 0.5) or 0) * 1000,
+        "wait_p95_ms": (percentile(watcher.waits, 0.95) or 0) * 1000,
+        "wait_p99_ms": (percentile(watcher.waits, 0.99) or 0) * 1000,
+        "peak_workers": sampler.workers,
+        "baseline_rss_mb": baseline_rss / 2**20,
+        "baseline_pss_mb": baseline_pss / 2**20,
+        "peak_rss_mb": sampler.rss / 2**20,
+        "peak_pss_mb": sampler.pss / 2**20,
+    }
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else {}
+    for key, value in results.items():
+        if not isinstance(value, (int, float)):
+            continue
+        line = f"{key:<18} {value:12.2f}"
+        if isinstance(baseline.get(key), (int, float)) and baseline[key]:
+            line += f"  {(value / baseline[key] - 1) * 100:+7.1f}%"
+        print(line)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Startup cost of submitting a job with the throttle client.
+
+    python benchmarks/startup.py [--runs 20] [--budget-ms 20]
+
+Runs the client against a stub server answering the framed protocol and
+reports the time spent importing modules (from python -X importtime) and the
+wall time of a submission next to a bare interpreter start. Fails if the
+imports go over budget or pull in modules the fast path shouldn't need.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from throttle_cli import ipc  # noqa: E402
+
+SUBMIT = (
+    "import sys; sys.argv = ['throttle', 'true']; "
+    "from throttle_cli.cli_client import main; main()"
+)
+FORBIDDEN = [
+    "argparse",
+    "asyncio",
+    "importlib.metadata",
+    "jsonrpclib",
+    "prettytable",
+    "throttle_cli.infoparser",
+    "throttle_cli.structures",
+    "typing",
+    "xdg",
+]
+
+
+def stub_server(socketpath):
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(socketpath)
+    srv.listen(64)
+
+    def serve(conn):
+        with conn, conn.makefile("rb") as f:
+            while header := f.read(ipc.HEADER.size):
+                (length,) = ipc.HEADER.unpack(header)
+                request = json.loads(f.read(length))
+                if request.get("id") is not None:
+                    conn.sendall(ipc.encode({"id": request["id"], "result": None}))
+
+    def accept():
+        while True:
+            conn, _ = srv.accept()
+            threading.Thread(target=serve, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+
+
+def run(code, env, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    start = time.perf_counter()
+    proc = subprocess.run(
+        cmd + ["-c", code], env=env, capture_output=True, text=True, check=True
+    )
+    return time.perf_counter() - start, proc
+
+
+def toplevel_imports(stderr):
+    """
+    Cumulative microseconds of the modules imported at the top level.
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.startswith("  ") or not cumulative.strip().isdigit():
+            continue
+        imports[name.strip()] = int(cumulative)
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    stub_server(os.path.join(tmp, "throttle.sock"))
+    env = dict(os.environ, XDG_RUNTIME_DIR=tmp)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(ROOT), env.get("PYTHONPATH")])
+    )
+
+    _, proc = run("pass", env, importtime=True)
+    startup = toplevel_imports(proc.stderr)
+    _, proc = run(SUBMIT, env, importtime=True)
+    imports = {
+        name: us
+        for name, us in toplevel_imports(proc.stderr).items()
+        if name not in startup
+    }
+    _, proc = run(SUBMIT + "; print('\\n'.join(sys.modules))", env)
+    forbidden = sorted(set(FORBIDDEN) & set(proc.stdout.split()))
+
+    bare = statistics.median(run("pass", env)[0] for _ in range(args.runs))
+    submit = statistics.median(run(SUBMIT, env)[0] for _ in range(args.runs))
+    import_ms = sum(imports.values()) / 1000
+
+    print(f"interpreter start:      {bare * 1000:7.2f} ms")
+    print(f"submitting a job:       {submit * 1000:7.2f} ms")
+    print(f"imports of the client:  {import_ms:7.2f} ms (budget {args.budget_ms} ms)")
+    for name, us in sorted(imports.items(), key=lambda item: -item[1]):
+        print(f"  {name:<30} {us / 1000:7.2f} ms")
+    if forbidden:
+        print(f"imported on the fast path: {', '.join(forbidden)}")
+    if forbidden or import_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,10 @@
-import importlib.metadata
-from contextlib import suppress
-from pathlib import Path
-
-
 def extract_version() -> str:
     """Returns either the version of installed package or the one
     found in nearby pyproject.toml"""
+    import importlib.metadata
+    from contextlib import suppress
+    from pathlib import Path
+
     with suppress(FileNotFoundError, StopIteration):
         with open(
             (root_dir := Path(__file__).parent.parent) / "pyproject.toml",
@@ -20,4 +19,11 @@ def extract_version() -> str:
     return importlib.metadata.version(__package__ or __name__.split(".", maxsplit=1)[0])
 
 
-__version__ = extract_version()
+def __getattr__(name: str) -> str:
+    # the version is only looked up when asked for, so that submitting a job
+    # doesn't have to read pyproject.toml or the package metadata
+    if name == "__version__":
+        global __version__
+        __version__ = extract_version()
+        return __version__
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
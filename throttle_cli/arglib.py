@@ -3,6 +3,7 @@ Based on the argparse implementation of _AppendAction
 
 https://github.com/python/cpython/blob/main/Lib/argparse.py
 """
+
 import argparse
 
 
@@ -38,3 +39,31 @@ class storeSilentJob(storeJob):
     def __call__(self, parser, namespace, values, option_string=None):
         self.append(namespace, "job", values)
         self.append(namespace, "notifications", 0)
+
+
+class storeThen(storeJob):
+    def __call__(self, parser, namespace, values, option_string=None):
+        self.append(namespace, "then", (values, 1))
+
+
+class storeSilentThen(storeJob):
+    def __call__(self, parser, namespace, values, option_string=None):
+        self.append(namespace, "then", (values, 0))
+
+
+UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60, "w": 7 * 24 * 60 * 60}
+
+
+def duration(value):
+    """
+    Seconds in a duration like 90, 90s, 15m, 12h, 7d or 2w.
+    """
+    unit = UNITS.get(value[-1:], None)
+    number = value[:-1] if unit else value
+    try:
+        seconds = float(number) * (unit or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid duration: {value}")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"duration must be positive: {value}")
+    return seconds
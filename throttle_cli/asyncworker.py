@@ -0,0 +1,266 @@
+import asyncio
+import ctypes
+import logging
+import shlex
+import signal
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Any, Dict
+
+from .commandworker import CommandWorker
+from .output import CHUNK, Capture, RingBuffer
+from .structures import ActionType, Msg
+
+
+@dataclass
+class asyncworkeritem:
+    task: asyncio.Task
+    q: asyncio.Queue
+    e: asyncio.Event
+    wake: asyncio.Event
+    gate: asyncio.Event
+    slot: asyncio.Event
+    pgid: ctypes.c_int
+    t: float
+
+    def is_alive(self) -> bool:
+        return not self.task.done() and not self.e.is_set()
+
+    def put(self, msg: Msg) -> None:
+        self.q.put_nowait(msg)
+
+    def reload(self, generation: int, config: Dict[str, Any]) -> None:
+        # the tasks use the config of the message worker
+        pass
+
+    def empty(self) -> bool:
+        return self.q.empty()
+
+
+class AsyncCommandWorker(CommandWorker):
+    """
+    Runs each job's queue as a task in a single event loop instead of forking a
+    process for each job.
+    """
+
+    loop: asyncio.AbstractEventLoop
+
+    def msgworker(self) -> None:
+        asyncio.run(self.amsgworker())
+
+    async def amsgworker(self) -> None:
+        """
+        Handle client inputs from the queue.
+        """
+        loop = self.loop = asyncio.get_running_loop()
+        self.startTimers()
+        self.replayJournal()
+        try:
+            while True:
+                msg: Msg = await loop.run_in_executor(None, self.q.get)
+                self.logger.info(f"handling {msg}")
+                self.dispatch(msg)
+        finally:
+            self.history.flush()
+            if self.journal is not None:
+                self.journal.close()
+
+    def createWorker(self, job: str) -> asyncworkeritem:  # type: ignore[override]
+        q: asyncio.Queue[Msg] = asyncio.Queue()
+        e = asyncio.Event()
+        wake = asyncio.Event()
+        gate = asyncio.Event()
+        breaker = self.breakerOf(job)
+        if breaker is None or not breaker.holds(job):
+            gate.set()
+        slot = asyncio.Event()
+        slot.set()
+        pgid = ctypes.c_int(0)
+        task = asyncio.create_task(
+            self.worker(q, e, wake, gate, slot, pgid, self.timeout, job)
+        )
+        task.add_done_callback(
+            lambda _: self.dispatch(Msg(action=ActionType.CLEAN, jobs=[job]))
+        )
+        return asyncworkeritem(task, q, e, wake, gate, slot, pgid, time.time())
+
+    def post(self, msg: Msg) -> None:
+        # also called from the threads failures are handled in
+        self.loop.call_soon_threadsafe(self.dispatch, msg)
+
+    def callLater(self, delay: float, callback, *args) -> None:
+        asyncio.get_running_loop().call_later(delay, callback, *args)
+
+    async def pump(
+        self, stream: asyncio.StreamReader, capture: Capture, buf: RingBuffer
+    ) -> None:
+        while data := await stream.read(CHUNK):
+            capture.write(buf, data)
+
+    async def handlejobs(
+        self,
+        msg: Msg,
+        e: asyncio.Event,
+        wake: asyncio.Event,
+        gate: asyncio.Event,
+        slot: asyncio.Event,
+        pgid: ctypes.c_int,
+        logger,
+    ) -> Dict[str, Any]:
+        run: Dict[str, Any] = {"start": time.time(), "attempts": 0}
+        if msg.notification:
+            retry_sequence = self.retry_sequence
+        else:
+            retry_sequence = self.retry_sequence_silent
+        # a run resumed from the journal carries on with the retries it was at
+        error_counter = msg.data.get("failures", 0)
+        retry_timeout_index = min(error_counter, len(retry_sequence) - 1) - 1
+        while True:
+            if not gate.is_set():
+                logger.info(f"{msg.job}: paused by its breaker")
+                await gate.wait()
+            if not slot.is_set() and not e.is_set():
+                self.post(
+                    Msg(action=ActionType.RETRY, jobs=[msg.job], origin=msg.origin)
+                )
+                await slot.wait()
+            # whatever cut the wait short is taken care of by this attempt
+            wake.clear()
+            if e.is_set():
+                break
+            if retry_timeout_index + 1 < len(retry_sequence):
+                retry_timeout_index += 1
+            success = True
+            logger.debug(msg)
+            logger.debug(f"running job: {msg.job} with timeout {self.job_timeout}")
+            capture = self.openCapture(msg.job)
+            started = time.monotonic()
+            run["attempts"] += 1
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *shlex.split(msg.job),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True,
+                )
+                pgid.value = proc.pid
+                if e.is_set():
+                    # killed while the command was starting
+                    self.signalGroup(proc.pid, signal.SIGKILL)
+                try:
+                    await asyncio.wait_for(
+                        asyncio.gather(
+                            self.pump(proc.stdout, capture, capture.stdout),
+                            self.pump(proc.stderr, capture, capture.stderr),
+                            proc.wait(),
+                        ),
+                        timeout=self.job_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.signalGroup(proc.pid, signal.SIGKILL)
+                    await proc.wait()
+                    raise subprocess.TimeoutExpired(msg.job, self.job_timeout)
+                duration = time.monotonic() - started
+                if e.is_set():
+                    logger.info(f"{msg.job} was killed")
+                    break
+                if proc.returncode != 0:
+                    success = False
+                    error_counter = await asyncio.to_thread(
+                        self.handleFailure,
+                        msg,
+                        logger,
+                        error_counter,
+                        proc.returncode,
+                        capture.stdout.tail(),
+                        capture.stderr.tail(),
+                    )
+            except Exception as error:
+                success = False
+                duration = time.monotonic() - started
+                error_counter = await asyncio.to_thread(
+                    self.handleError, msg, logger, error_counter, error
+                )
+            finally:
+                pgid.value = 0
+                capture.close()
+
+            if success:
+                run["duration"] = duration
+                break
+            # the slot is given up while waiting, and waited for again before
+            # the next attempt
+            slot.clear()
+            self.post(
+                Msg(
+                    action=ActionType.FAILED,
+                    jobs=[msg.job],
+                    t=msg.t,
+                    id=msg.id,
+                    data={"duration": duration},
+                )
+            )
+            if e.is_set():
+                break
+            try:
+                await asyncio.wait_for(
+                    wake.wait(), timeout=retry_sequence[retry_timeout_index]
+                )
+                wake.clear()
+            except asyncio.TimeoutError:
+                pass
+        run["end"] = time.time()
+        return run
+
+    async def worker(
+        self,
+        q: asyncio.Queue,
+        e: asyncio.Event,
+        wake: asyncio.Event,
+        gate: asyncio.Event,
+        slot: asyncio.Event,
+        pgid: ctypes.c_int,
+        timeout,
+        name,
+    ) -> None:
+        logger_name = f"{name.replace(' ','_')}_worker"
+        logger = logging.getLogger(logger_name)
+        counter = 0
+        cont_counter = 0
+        # of the inputs at the start of the last successful run
+        last = None
+        logger.debug(f"starting task for {logger_name}")
+
+        while True:
+            if e.is_set():
+                break
+            try:
+                msg = await asyncio.wait_for(q.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.debug(f"closing task for {logger_name}")
+                break
+            if msg.action == ActionType.RUN:
+                # scanning the inputs shouldn't hold up the event loop
+                fingerprint = await asyncio.get_running_loop().run_in_executor(
+                    None, self.fingerprint, name
+                )
+                if self.skip(msg, fingerprint, last, logger):
+                    self.advance(msg)
+                    continue
+                counter += 1
+                logger.debug(f"start run no: {counter} (CONT: {cont_counter})")
+                self.post(Msg(action=ActionType.STARTED, jobs=[name], t=msg.t))
+                run = await self.handlejobs(msg, e, wake, gate, slot, pgid, logger)
+                logger.debug(f"finish run no: {counter} (CONT: {cont_counter})")
+                if not e.is_set():
+                    if fingerprint is not None:
+                        run["fingerprint"] = last = fingerprint
+                    self.post(
+                        Msg(action=ActionType.DONE, jobs=[name], t=msg.t, data=run)
+                    )
+            else:
+                cont_counter += 1
+                logger.debug(f"handling CONT no. {cont_counter}")
+            self.advance(msg)
+        e.set()
@@ -0,0 +1,109 @@
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+
+def checkBreaker(section: Dict[str, Any]) -> None:
+    """
+    Raise ValueError if a [[breakers]] config section can't be used.
+    """
+    if not isinstance(section.get("name"), str):
+        raise ValueError(f"{section} in breakers needs a name")
+    for key in ("threshold", "window", "backoff", "max_backoff", "spread"):
+        value = section.get(key, 1)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+            raise ValueError(f"{section} in breakers has an invalid {key}")
+
+
+class Breaker:
+    """
+    Circuit breaker shared by a group of jobs that fail together, e.g. all
+    the mbsync jobs when the network is down.
+
+    It opens once its jobs failed threshold times within window seconds, and
+    the message worker pauses them. After a backoff one of them is let
+    through as a probe (half-open): if it succeeds the breaker closes and the
+    others are let through at random within spread seconds, if it fails the
+    breaker opens again for twice as long, up to max_backoff. Backoffs are
+    jittered, so that breakers opened together don't probe together.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.threshold = 5
+        self.window: float = 60
+        self.backoff: float = 30
+        self.max_backoff: float = 600
+        self.spread: float = 10
+        self.state = "closed"
+        self.failures: Deque[float] = deque()
+        # times it opened since it was last closed
+        self.trips = 0
+        # when the backoff of an open breaker ends
+        self.until = 0.0
+        self.probe: Optional[str] = None
+        # bumped on every change, timers of an earlier state are ignored
+        self.generation = 0
+
+    def configure(self, section: Dict[str, Any]) -> None:
+        self.threshold = section.get("threshold", 5)
+        self.window = section.get("window", 60)
+        self.backoff = section.get("backoff", 30)
+        self.max_backoff = section.get("max_backoff", 600)
+        self.spread = section.get("spread", 10)
+
+    def failed(self, job: str) -> bool:
+        """
+        Count a failed attempt of a job, returns whether the breaker opens.
+        """
+        if self.state == "half-open":
+            return job == self.probe
+        if self.state == "open":
+            return False
+        now = time.monotonic()
+        self.failures.append(now)
+        while self.failures[0] < now - self.window:
+            self.failures.popleft()
+        return len(self.failures) >= self.threshold
+
+    def open(self) -> float:
+        """
+        Open the breaker, returns the seconds until it lets a probe through.
+        """
+        self.trips += 1
+        backoff = min(self.backoff * 2 ** (self.trips - 1), self.max_backoff)
+        # half of it fixed, half of it random
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+        self.state = "open"
+        self.until = time.time() + delay
+        self.probe = None
+        self.failures.clear()
+        self.generation += 1
+        return delay
+
+    def halfOpen(self, probe: str) -> None:
+        self.state = "half-open"
+        self.probe = probe
+        self.generation += 1
+
+    def close(self) -> None:
+        self.state = "closed"
+        self.trips = 0
+        self.probe = None
+        self.generation += 1
+
+    def holds(self, job: str) -> bool:
+        """
+        Whether the job has to wait before its next attempt.
+        """
+        if self.state == "open":
+            return True
+        return self.state == "half-open" and job != self.probe
+
+    def describe(self) -> str:
+        if self.state == "open":
+            return f"{self.name} open for {max(self.until - time.time(), 0):.0f}s"
+        if self.state == "half-open":
+            return f"{self.name} half-open"
+        return self.name
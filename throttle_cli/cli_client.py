@@ -1,15 +1,66 @@
-from pathlib import Path
+# hooks call throttle a lot, so submitting a job only imports what it needs,
+# everything else is imported when the full argument parser is used
+import os
+import sys
 
-from xdg import BaseDirectory
+JOB_OPTIONS = {"-j": 1, "--job": 1, "-J": 0, "--silent-job": 0}
+THEN_OPTIONS = {"--then": 1, "--silent-then": 0}
 
-from . import __version__
-from .arglib import storeJob, storeSilentJob
-from .client import get_info, send_message
-from .structures import ActionType
+
+def fastargs(argv):
+    """
+    Parse the usual job submitting invocations without argparse. Returns None
+    for anything else (including abbreviated options), which is left to main.
+    """
+    jobs = []
+    notifications = []
+    then = []
+    unknownargs = []
+    origin = None
+    kill = False
+    args = iter(argv)
+    for arg in args:
+        if not arg.startswith("-"):
+            unknownargs.append(arg)
+        elif arg in ("-k", "--kill"):
+            kill = True
+        elif arg in JOB_OPTIONS or arg in THEN_OPTIONS or arg in ("-o", "--origin"):
+            value = next(args, None)
+            if value is None or value.startswith("-"):
+                return None
+            if arg in JOB_OPTIONS:
+                jobs.append(value)
+                notifications.append(JOB_OPTIONS[arg])
+            elif arg in THEN_OPTIONS:
+                then.append((value, THEN_OPTIONS[arg]))
+            else:
+                origin = value
+        else:
+            return None
+    return kill, jobs or None, notifications, origin, unknownargs, then
 
 
 def main():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    parsed = fastargs(sys.argv[1:])
+    if runtime_dir and parsed is not None:
+        from .client import send_message
+
+        send_message(os.path.join(runtime_dir, "throttle.sock"), *parsed)
+        return
+    fullmain()
+
+
+def fullmain():
     import argparse
+    from pathlib import Path
+
+    from xdg import BaseDirectory
+
+    from . import __version__
+    from .arglib import duration, storeJob, storeSilentJob, storeSilentThen, storeThen
+    from .client import get_info, send_message, watch
+    from .structures import ActionType
 
     parser = argparse.ArgumentParser(
         prog="throttle", description="send jobs to the throttle server"
@@ -29,6 +80,20 @@ def main():
         action=storeSilentJob,
         help="Same as --job, but no notifications will be sent on failure.",
     )
+    parser.add_argument(
+        "--then",
+        action=storeThen,
+        metavar="JOB",
+        help="Job to execute after the other jobs and the earlier --then jobs "
+        "finished, can be given multiple times. Submissions leading to the same "
+        "--then job while it is still waiting share a single run of it.",
+    )
+    parser.add_argument(
+        "--silent-then",
+        action=storeSilentThen,
+        metavar="JOB",
+        help="Same as --then, but no notifications will be sent on failure.",
+    )
     parser.add_argument(
         "-k", "--kill", action="store_true", help="Kill a previously started job."
     )
@@ -43,11 +108,27 @@ def main():
         action="store_true",
         help="Print statistics for handled commands.",
     )
+    parser.add_argument(
+        "--since",
+        type=duration,
+        help="With --statistics, only count the last SINCE (e.g. 90m, 24h, 7d), "
+        "including earlier runs of the server.",
+    )
     parser.add_argument(
         "--status",
         action="store_true",
         help="Print status information for currently running workers.",
     )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Print the status, then follow what the server does as it happens.",
+    )
+    parser.add_argument(
+        "--jsonrpc",
+        action="store_true",
+        help="Talk JSON-RPC to a server started with --jsonrpc.",
+    )
     parser.add_argument(
         "--format",
         choices=["text", "csv", "latex", "html", "json", "markdown", "plain"],
@@ -57,17 +138,27 @@ def main():
     args, unknownargs = parser.parse_known_args()
     socketpath = Path(BaseDirectory.get_runtime_dir()) / "throttle.sock"
     if args.statistics:
-        get_info(socketpath, ActionType.STATS, args.format)
+        get_info(socketpath, ActionType.STATS, args.format, args.jsonrpc, args.since)
+        return
+    if args.watch:
+        watch(socketpath, args.format)
         return
     if args.status:
-        get_info(socketpath, ActionType.STATUS, args.format)
+        get_info(socketpath, ActionType.STATUS, args.format, args.jsonrpc)
         return
     if hasattr(args, "notifications"):
         notifications = args.notifications
     else:
         notifications = []
     send_message(
-        socketpath, args.kill, args.job, notifications, args.origin, unknownargs
+        socketpath,
+        args.kill,
+        args.job,
+        notifications,
+        args.origin,
+        unknownargs,
+        args.then,
+        jsonrpc=args.jsonrpc,
     )
 
 
@@ -18,6 +18,28 @@ def main():
         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
         help="Set loglevel.",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["process", "asyncio"],
+        default="process",
+        help="Run each job in its own process or all jobs in a single event loop.",
+    )
+    parser.add_argument(
+        "--jsonrpc",
+        action="store_true",
+        help="Also answer the JSON-RPC requests of older clients on throttle.sock.",
+    )
+    parser.add_argument(
+        "--datagram",
+        action="store_true",
+        help="Also take jobs as datagrams on throttle-dgram.sock, without replies.",
+    )
+    parser.add_argument(
+        "--datagram-backlog",
+        type=int,
+        default=10000,
+        help="Drop datagrams while this many messages are waiting to be handled.",
+    )
     parser.add_argument(
         "--version", action="version", version=f"throttle {__version__}"
     )
@@ -26,7 +48,17 @@ def main():
     loglevel = logging.INFO
     if args.LOGLEVEL:
         loglevel = getattr(logging, args.LOGLEVEL)
-    start_server(socketpath, loglevel)
+    datagrampath = (
+        socketpath.with_name("throttle-dgram.sock") if args.datagram else None
+    )
+    start_server(
+        socketpath,
+        loglevel,
+        args.engine,
+        args.jsonrpc,
+        datagrampath,
+        args.datagram_backlog,
+    )
 
 
 if __name__ == "__main__":
@@ -1,48 +1,71 @@
-from pathlib import Path
-from typing import List
+import os
 
-from jsonrpclib import ServerProxy
+from .ipc import Client, send_datagram
 
-from .infoparser import parse_stat, parse_status
-from .structures import ActionType
 
-
-def send_message(
-    socketpath: Path,
-    kill: bool,
-    jobs: List[str],
-    notifications: List[int],
-    origin: str,
-    unknownargs: List[str],
-) -> None:
-    if not socketpath.exists():
+def connect(socketpath, jsonrpc: bool = False):
+    """
+    Connect to the server with the framed protocol, or JSON-RPC if it was
+    started with --jsonrpc.
+    """
+    if not os.path.exists(socketpath):
         print("Socket doesn't exist, is the throttle server running?")
         print("You can start the server by running throttle-server")
         import sys
 
         sys.exit(1)
-    action = ActionType.KILL if kill else ActionType.RUN
-    mergedjobs: List[str] = []
+    if jsonrpc:
+        from jsonrpclib import ServerProxy
+
+        return ServerProxy(f"unix+http://{socketpath}")
+    return Client(socketpath)
+
+
+def send_message(
+    socketpath,
+    kill: bool,
+    jobs: list[str],
+    notifications: list[int],
+    origin: str,
+    unknownargs: list[str],
+    then: list[tuple[str, int]] | None = None,
+    jsonrpc: bool = False,
+) -> None:
+    # actions are sent by name, so that structures doesn't need importing
+    action = "KILL" if kill else "RUN"
+    mergedjobs: list[str] = []
     if notifications is None:
         notifications = []
+    if then is None:
+        then = []
     if jobs is not None:
         mergedjobs += jobs
     if len(unknownargs) > 0:
         mergedjobs += [" ".join(unknownargs)]
         notifications.append(1)
-    if len(mergedjobs) == 0:
+    if len(mergedjobs) == 0 and len(then) == 0:
+        return
+    msg = {
+        "action": action,
+        "jobs": mergedjobs + [job for job, _ in then],
+        "notifications": notifications + [notification for _, notification in then],
+        "origin": origin,
+    }
+    if then and not kill:
+        # the jobs run one after the other as a chain does, but are waited for
+        # by name, so the --then jobs are shared with other submissions
+        msg["after"] = [[i - 1] if i else [] for i in range(len(msg["jobs"]))]
+    datagrampath = os.path.join(os.path.dirname(socketpath), "throttle-dgram.sock")
+    if not jsonrpc and send_datagram(datagrampath, msg):
         return
     try:
-        client = ServerProxy(f"unix+http://{socketpath}")
-        client.handle(
-            {
-                "action": action,
-                "jobs": mergedjobs,
-                "notifications": notifications,
-                "origin": origin,
-            }
-        )
-        client("close")()
+        client = connect(socketpath, jsonrpc)
+        if jsonrpc:
+            client.handle(msg)
+            client("close")()
+        else:
+            with client:
+                client.handle([msg])
     except ConnectionRefusedError:
         import sys
 
@@ -53,21 +76,25 @@ def send_message(
         sys.exit(1)
 
 
-def get_info(socketpath, action, format):
-    if not socketpath.exists():
-        print("Socket doesn't exist, is the throttle server running?")
-        print("You can start the server by running throttle-server")
-        import sys
+def get_info(socketpath, action, format, jsonrpc: bool = False, since=None):
+    from .infoparser import parse_stat, parse_status
+    from .structures import ActionType
 
-        sys.exit(1)
+    msg = {"action": action.name}
+    if since:
+        msg["data"] = {"since": since}
     try:
-        client = ServerProxy(f"unix+http://{socketpath}")
-        retval = client.info({"action": action})
+        client = connect(socketpath, jsonrpc)
+        if jsonrpc:
+            retval = client.info(msg)
+            client("close")()
+        else:
+            with client:
+                retval = client.call("info", msg)
         if action == ActionType.STATS:
             print(parse_stat(retval, format))
         elif action == ActionType.STATUS:
             print(parse_status(retval, format))
-        client("close")()
     except ConnectionRefusedError:
         import sys
 
@@ -76,3 +103,28 @@ def get_info(socketpath, action, format):
             file=sys.stderr,
         )
         sys.exit(1)
+
+
+def watch(socketpath, format):
+    from .infoparser import parse_event, parse_status
+
+    try:
+        with connect(socketpath) as client:
+            print(parse_status(client.call("watch", None), format), flush=True)
+            for event in client.events():
+                print(parse_event(event), flush=True)
+    except KeyboardInterrupt:
+        pass
+    except ConnectionRefusedError:
+        import sys
+
+        print(
+            "Connection refused: did you start the server with `throttle-server`?",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    except ConnectionError:
+        import sys
+
+        print("The server closed the connection.", file=sys.stderr)
+        sys.exit(1)
@@ -1,20 +1,45 @@
+import copy
+import heapq
 import logging
 import os
 import queue
+import random
 import re
 import shlex
+import signal
 import subprocess
+import threading
 import time
-from dataclasses import dataclass
-from multiprocessing import Event, Process, Queue
+from dataclasses import dataclass, field
+from multiprocessing import Process, Queue, get_context
 from multiprocessing.synchronize import Event as SyncEvent
 from pathlib import Path
-from typing import Dict, List
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import toml
 from xdg import BaseDirectory
 
+from . import history, inotify, loglib
+from .breaker import Breaker, checkBreaker
+from .filters import Filters
+from .fingerprint import Fingerprint
+from .graph import Graph, joinitem
+from .journal import Journal
+from .metrics import TextfileWriter
+from .notifier import Notifier
+from .output import Capture, RotatingFile, communicate, output_path
+from .periodic import Schedule, checkSchedule
+from .pressure import Pressure
+from .ratelimit import TokenBucket
+from .scheduler import Scheduler
 from .structures import ActionType, Msg
+from .triggers import PathTrigger, checkWatch
+
+# job workers are started by a forkserver instead of being forked from the
+# message worker, whose threads may hold a lock (e.g. of logging) at the time;
+# the queues and values they are handed have to come from it too
+WORKERS = get_context("forkserver")
+WORKERS.set_forkserver_preload(["throttle_cli.commandworker"])
 
 
 @dataclass
@@ -22,130 +47,1382 @@ class workeritem:
     p: Process
     q: Queue
     e: SyncEvent
+    # set on kill and on new runs to cut a retry wait short
+    wake: SyncEvent
+    # cleared while the breaker of the job pauses it
+    gate: SyncEvent
+    # cleared while the job waits for a slot to retry a failed attempt
+    slot: SyncEvent
+    # process group of the running command, 0 if there is none
+    pgid: Any
+    # the settings of its job after each reload, with its generation
+    configs: Queue
     t: float
 
+    def is_alive(self) -> bool:
+        # the event is set once the worker was killed or stopped taking jobs
+        return self.p.is_alive() and not self.e.is_set()
+
+    def reload(self, generation: int, config: Dict[str, Any]) -> None:
+        if self.is_alive():
+            self.configs.put((generation, config))
+
+    def put(self, msg: Msg) -> None:
+        self.q.put(msg)
+
+    def empty(self) -> bool:
+        # Queue.empty() polls the pipe, which lags behind put() until the
+        # feeder thread flushed, the size is counted when putting
+        return self.q.qsize() == 0
+
+
+@dataclass
+class holditem:
+    deadline: float
+    msgs: List[Msg] = field(default_factory=list)
+    t: float = field(default_factory=time.time)
+
+    def fold(self, msg: Msg) -> bool:
+        """
+        Fold a trigger into the held back run, keeping its chain going.
+        Returns whether the message is kept for that.
+        """
+        if any(m.jobs[m.index :] == msg.jobs[msg.index :] for m in self.msgs):
+            # the rest of the chain is already going to be triggered
+            return False
+        if msg.cont():
+            self.msgs.append(msg)
+            return True
+        return False
+
+
+def checkConfig(config: Dict[str, Any]) -> None:
+    """
+    Raise ValueError if a config can't be used.
+    """
+    for key in (
+        "task_timeout",
+        "job_timeout",
+        "kill_grace",
+        "notify_on_counter",
+        "filter_cache_size",
+        "max_concurrent",
+        "statistics_flush_interval",
+        "statistics_retention_days",
+        "metrics_interval",
+        "notification_queue_size",
+        "notification_dedup_window",
+        "notification_digest_interval",
+        "journal_fsync_interval",
+        "priority_aging",
+        "pressure_cpu",
+        "pressure_memory",
+        "pressure_io",
+        "pressure_loadavg",
+        "pressure_interval",
+        "output_tail_kb",
+        "output_file_size_kb",
+        "output_file_backups",
+    ):
+        value = config.get(key, 0)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"{key} must be a non-negative number, not {value!r}")
+    if config.get("pressure_interval", 1) <= 0:
+        raise ValueError("pressure_interval must be positive")
+    for key in ("retry_sequence", "retry_sequence_silent"):
+        value = config.get(key, [0])
+        if (
+            not isinstance(value, list)
+            or not value
+            or not all(isinstance(v, (int, float)) and v >= 0 for v in value)
+        ):
+            raise ValueError(f"{key} must be a list of non-negative numbers")
+    for key in ("notification_cmd", "metrics_textfile"):
+        if not isinstance(config.get(key, ""), str):
+            raise ValueError(f"{key} must be a string")
+    if config.get("metrics_format", "prometheus") not in ("prometheus", "openmetrics"):
+        raise ValueError("metrics_format must be prometheus or openmetrics")
+    for section in ("filters", "limits", "jobs", "classes", "breakers"):
+        for item in config.get(section, []):
+            try:
+                re.compile(item.get("pattern", ""))
+                re.compile(item.get("origin", ""))
+            except (re.error, TypeError, AttributeError) as e:
+                raise ValueError(f"{item} in {section} has an invalid pattern: {e}")
+    for item in config.get("jobs", []):
+        inputs = item.get("inputs", [])
+        if not isinstance(inputs, list) or not all(isinstance(i, str) for i in inputs):
+            raise ValueError(f"{item} in jobs has inputs that aren't a list of paths")
+    for section in config.get("breakers", []):
+        checkBreaker(section)
+    names = {section["name"] for section in config.get("breakers", [])}
+    for item in config.get("jobs", []):
+        if "breaker" in item and item["breaker"] not in names:
+            raise ValueError(f"{item} in jobs has a breaker that isn't configured")
+    for section in config.get("watch", []):
+        checkWatch(section)
+    for section in config.get("schedule", []):
+        checkSchedule(section)
+    for item in config.get("classes", []):
+        priority = item.get("priority", 0)
+        if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+            raise ValueError(f"{item} in classes has an invalid priority")
+
+
+# of the jobs no [[classes]] config section matches
+DEFAULT_CLASS: Dict[str, Any] = {"name": "default", "priority": 0}
+
 
 class CommandWorker:
-    def __init__(self, queue: Queue, logqueue: Queue, comqueue: Queue):
+    # how long to gather changes before publishing a snapshot
+    SNAPSHOT_DELAY = 0.1
+    # how long the config file has to be left alone before it's reloaded
+    CONFIG_SETTLE = 0.2
+
+    def __init__(
+        self,
+        queue: Queue,
+        logqueue: Queue,
+        comqueue: Queue,
+        eventqueue: Optional[Queue] = None,
+    ):
         self.q = queue
         self.logqueue = logqueue
         self.comqueue = comqueue
+        self.eventqueue = eventqueue
+        self.watchers = 0
+        self.version = 0
+        self.dirty = False
         self.logger = logging.getLogger("msg_worker")
         self.data: Dict[str, workeritem] = {}
-        self.timeout = 30
-        self.filters: List[Dict[str, str]] = []
-        self.notification_cmd = None
-        self.notify_on_counter = 0
-        self.job_timeout = 60 * 60
-        self.retry_sequence = [5, 15, 30, 60, 120, 300, 900]
-        self.retry_sequence_silent = [5, 15, 30, 60]
+        self.notifier = Notifier()
         self.statistics = {"start": time.time(), "jobs": {}}
+        # jobs whose statistics changed since the last snapshot
+        self.touched: Set[str] = set()
+        self.history = history.History()
+        self.metrics: Optional[TextfileWriter] = None
+        self.scheduler = Scheduler()
+        self._jobOptions: Dict[str, Dict[str, Any]] = {}
+        self.debouncing: Dict[str, holditem] = {}
+        self.buckets: Dict[str, Optional[TokenBucket]] = {}
+        self.deferred: Dict[str, holditem] = {}
+        self.pressure = Pressure()
+        # runs held back while the system is under pressure
+        self.pressured: Dict[str, holditem] = {}
+        self.pressure_checking = False
+        self.graph = Graph()
+        self.breakers: Dict[str, Breaker] = {}
+        # class of the latest trigger of each job
+        self.jobclass: Dict[str, str] = {}
+        # fingerprint of the inputs at the start of the last successful run of
+        # each job, a worker starts out with the one of its job known by then
+        self.inputs: Dict[str, str] = {}
+        self._fingerprints: Dict[str, Fingerprint] = {}
+        self.timers: List[Tuple[float, int, Callable, Tuple]] = []
+        self._timercounter = 0
+        self.journal: Optional[Journal] = None
+        self.triggers: List[PathTrigger] = []
+        self.schedules: List[Schedule] = []
+        self.journal_dirty = False
+        # journaled messages handed to a worker, by the job of the worker
+        self.inflight: Dict[int, str] = {}
+        # bumped on every reload, so forked workers know to reload too
+        self.generation = WORKERS.Value("i", 0, lock=False)
+        self.loaded = 0
+
+        # let's fail if the config is messed up
+        self.applyConfig(self.readConfig())
+
+    # all that job workers are handed of the message worker, the settings of
+    # their job come from jobConfig
+    WORKER_STATE = ("q", "logqueue", "logger", "generation", "loaded")
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {key: self.__dict__[key] for key in self.WORKER_STATE}
 
-        self.loadConfig()
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.notifier = Notifier()
+        self._fingerprints = {}
 
-    def loadConfig(self):
+    def jobConfig(self, job: str) -> Dict[str, Any]:
+        """
+        The settings a job worker needs, resolved from the config for its job.
+        """
+        return {
+            "job": job,
+            "retry_sequence": self.retry_sequence,
+            "retry_sequence_silent": self.retry_sequence_silent,
+            "job_timeout": self.job_timeout,
+            "notify_on_counter": self.notify_on_counter,
+            "notification_cmd": self.notifier.cmd,
+            "output": self.output,
+            "options": self.jobOptions(job),
+            "inputs": self.inputs.get(job),
+        }
+
+    def applyJobConfig(self, config: Dict[str, Any]) -> None:
+        """
+        Set the settings of a job worker from the ones jobConfig resolved.
+        """
+        self.retry_sequence = config["retry_sequence"]
+        self.retry_sequence_silent = config["retry_sequence_silent"]
+        self.job_timeout = config["job_timeout"]
+        self.notify_on_counter = config["notify_on_counter"]
+        self.notifier.cmd = config["notification_cmd"]
+        self.output = config["output"]
+        job = config["job"]
+        self._jobOptions = {job: config["options"]}
+        self._fingerprints = {}
+        self.inputs = {job: config["inputs"]} if config["inputs"] else {}
+
+    def configPath(self) -> Path:
         configdir = BaseDirectory.load_first_config("throttle")
         if configdir is None:
-            return
-        configpath = Path(configdir) / "config.toml"
+            configdir = Path(BaseDirectory.xdg_config_home) / "throttle"
+        return Path(configdir) / "config.toml"
+
+    def readConfig(self) -> Dict[str, Any]:
+        """
+        Read and check the config, raises if it's messed up.
+        """
+        configpath = self.configPath()
         if not configpath.exists():
             self.logger.info(f"no configuration found at {configpath}")
+            return {}
+        config = toml.load(configpath)
+        self.logger.debug(f"config found: {config}")
+        checkConfig(config)
+        return config
+
+    def applyConfig(self, config: Dict[str, Any]) -> None:
+        """
+        Set everything from a checked config, falling back to the defaults for
+        the keys it doesn't have.
+        """
+        self.timeout = config.get("task_timeout", 30)
+        filters = []
+        for f in config.get("filters", []):
+            if "pattern" not in f or "substitute" not in f:
+                self.logger.error(f"{f} is not a valid filter config")
+                continue
+            filters.append(f)
+        self.filters = Filters(filters, config.get("filter_cache_size", 1024))
+        self.retry_sequence = config.get(
+            "retry_sequence", [5, 15, 30, 60, 120, 300, 900]
+        )
+        self.retry_sequence_silent = config.get(
+            "retry_sequence_silent", [5, 15, 30, 60]
+        )
+        self.notifier.cmd = config.get("notification_cmd")
+        self.notifier.maxsize = config.get("notification_queue_size", 100)
+        self.notifier.window = config.get("notification_dedup_window", 60)
+        self.notifier.interval = config.get("notification_digest_interval", 0)
+        self.notify_on_counter = config.get("notify_on_counter", 0)
+        self.job_timeout = config.get("job_timeout", 60 * 60)
+        self.kill_grace = config.get("kill_grace", 5)
+        self.history_interval = config.get("statistics_flush_interval", 60)
+        self.history.retention_days = config.get("statistics_retention_days", 30)
+        # only read on start, the journal can't be turned on or off on a reload
+        self.journal_enabled = config.get("journal", False)
+        self.journal_fsync_interval = config.get("journal_fsync_interval", 1)
+        if "metrics_textfile" in config:
+            path = Path(config["metrics_textfile"]).expanduser()
+            openmetrics = config.get("metrics_format", "prometheus") == "openmetrics"
+            if self.metrics is None or (
+                self.metrics.path,
+                self.metrics.openmetrics,
+            ) != (
+                path,
+                openmetrics,
+            ):
+                self.metrics = TextfileWriter(path, openmetrics)
+        else:
+            self.metrics = None
+        self.metrics_interval = config.get("metrics_interval", 15)
+        self.output = {
+            "output_tail_kb": config.get("output_tail_kb", 64),
+            "output_file": config.get("output_file", False),
+            "output_file_size_kb": config.get("output_file_size_kb", 1024),
+            "output_file_backups": config.get("output_file_backups", 3),
+        }
+        limits = []
+        for limit in config.get("limits", []):
+            if "pattern" not in limit or "max_concurrent" not in limit:
+                self.logger.error(f"{limit} is not a valid limit config")
+                continue
+            limits.append((limit["pattern"], limit["max_concurrent"]))
+        self.scheduler.configure(config.get("max_concurrent", 0), limits)
+        self.classes: List[Dict[str, Any]] = []
+        for cls in config.get("classes", []):
+            if "name" not in cls:
+                self.logger.error(f"{cls} is not a valid class config")
+                continue
+            self.classes.append(cls)
+        self.scheduler.aging = config.get("priority_aging", 60)
+        self.pressure.thresholds = {
+            resource: config.get(f"pressure_{resource}", 0)
+            for resource in ("cpu", "memory", "io", "loadavg")
+        }
+        self.pressure_interval = config.get("pressure_interval", 1)
+        # kept by name, so that a reload doesn't close an open breaker
+        breakers = {}
+        for section in config.get("breakers", []):
+            breaker = self.breakers.get(section["name"]) or Breaker(section["name"])
+            breaker.configure(section)
+            breakers[breaker.name] = breaker
+        self.breakers = breakers
+        self.breakerSections = config.get("breakers", [])
+        self.watches: List[Dict[str, Any]] = config.get("watch", [])
+        self.periodic: List[Dict[str, Any]] = config.get("schedule", [])
+        self.jobs: List[Dict[str, Any]] = []
+        for job in config.get("jobs", []):
+            if "pattern" not in job:
+                self.logger.error(f"{job} is not a valid job config")
+                continue
+            self.jobs.append(job)
+        self._jobOptions = {}
+        self._fingerprints = {}
+        # the fingerprints of jobs that don't declare inputs anymore are stale
+        self.inputs = {
+            job: fingerprint
+            for job, fingerprint in self.inputs.items()
+            if self.jobOptions(job).get("inputs")
+        }
+        # buckets of deferred runs are still needed to release them
+        self.buckets = {
+            job: bucket for job, bucket in self.buckets.items() if job in self.deferred
+        }
+        self.loaded = self.generation.value
+
+    def reloadConfig(self) -> None:
+        """
+        Swap in the current config between two messages, keeping the old one
+        if the new one is messed up. Running jobs are left alone, workers pick
+        up the new config before their next run.
+        """
+        try:
+            config = self.readConfig()
+        except Exception as e:
+            self.logger.error(
+                f"keeping the old config, failed to load the new one: {e}"
+            )
             return
+        metrics = self.metrics
+        self.generation.value += 1
+        self.applyConfig(config)
+        for job, item in self.data.items():
+            item.reload(self.generation.value, self.jobConfig(job))
+        self.logger.info("reloaded config")
+        if metrics is None and self.metrics is not None:
+            self.writeMetrics()
+        self.watchPaths()
+        self.startSchedules()
+        for job, item in self.data.items():
+            breaker = self.breakerOf(job)
+            if breaker is None or not breaker.holds(job):
+                # its breaker was removed or it isn't part of it anymore
+                item.gate.set()
+        # raised limits can make room for waiting jobs
+        self.schedule()
 
-        # let's fail if the config is messed up
-        config = toml.load(Path(configdir) / "config.toml")
-        self.logger.debug(f"config found: {config}")
-        if "task_timeout" in config:
-            self.timeout = config["task_timeout"]
-        if "filters" in config:
-            for f in config["filters"]:
-                if "pattern" not in f or "substitute" not in f:
-                    self.logger.error(f"{f} is not a valid filter config")
-            self.filters = config["filters"]
-        if "retry_sequence" in config:
-            self.retry_sequence = config["retry_sequence"]
-        if "retry_sequence_silent" in config:
-            self.retry_sequence_silent = config["retry_sequence_silent"]
-        if "notification_cmd" in config:
-            self.notification_cmd = config["notification_cmd"]
-        if "notify_on_counter" in config:
-            self.notify_on_counter = config["notify_on_counter"]
-        if "job_timeout" in config:
-            self.job_timeout = config["job_timeout"]
+    def watchConfig(self) -> None:
+        """
+        Reload the config when its file changes, as long as inotify is
+        available.
+        """
+        configpath = self.configPath()
+        try:
+            watcher = inotify.Watcher(
+                configpath.parent,
+                mask=inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO,
+            )
+        except OSError as e:
+            self.logger.info(f"not watching {configpath} for changes: {e}")
+            return
+
+        def watch() -> None:
+            while True:
+                paths = watcher.read()
+                # editors write in several steps, wait for them to settle
+                while watcher.wait(self.CONFIG_SETTLE):
+                    paths += watcher.read()
+                if configpath in paths:
+                    self.q.put(Msg(action=ActionType.RELOAD))
+
+        threading.Thread(target=watch, daemon=True).start()
+
+    def watchPaths(self) -> None:
+        """
+        Trigger the jobs of the [[watch]] config sections when their paths
+        change, replacing the watches of an earlier config.
+        """
+        if [trigger.section for trigger in self.triggers] == self.watches:
+            return
+        for trigger in self.triggers:
+            trigger.stop()
+        self.triggers = []
+        for section in self.watches:
+            trigger = PathTrigger(section, self.q)
+            try:
+                trigger.start()
+            except OSError as e:
+                self.logger.error(f"not watching {section['paths']}: {e}")
+                continue
+            self.triggers.append(trigger)
 
     def msgworker(self) -> None:
         """
         Handle client inputs from the queue.
         """
 
-        while True:
-            msg: Msg = self.q.get()
-            self.logger.info(f"handling {msg}")
-            match msg.action:
-                case ActionType.RUN:
-                    self.handleRun(msg)
-                case ActionType.CONT:
-                    self.handleRun(msg)
-                case ActionType.KILL:
-                    self.handleKill(msg)
-                case ActionType.CLEAN:
-                    self.handleCleanup()
-                case ActionType.STATS:
-                    self.comqueue.put(self.statistics)
-                case ActionType.STATUS:
-                    self.comqueue.put(self.get_status())
+        self.startTimers()
+        self.replayJournal()
+        try:
+            while True:
+                try:
+                    msg: Msg = self.q.get(timeout=self.runTimers())
+                except queue.Empty:
+                    continue
+                self.logger.info(f"handling {msg}")
+                self.dispatch(msg)
+        finally:
+            self.history.flush()
+            if self.journal is not None:
+                self.journal.close()
+
+    def callLater(self, delay: float, callback: Callable, *args) -> None:
+        """
+        Call back from the message worker after delay seconds.
+        """
+        self._timercounter += 1
+        heapq.heappush(
+            self.timers,
+            (time.monotonic() + delay, self._timercounter, callback, args),
+        )
+
+    def runTimers(self) -> Optional[float]:
+        """
+        Run the timers that are due, returns the seconds until the next one.
+        """
+        while self.timers:
+            deadline, _, callback, args = self.timers[0]
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                return delay
+            heapq.heappop(self.timers)
+            callback(*args)
+        return None
+
+    def dispatch(self, msg: Msg) -> None:
+        self.changed()
+        match msg.action:
+            case ActionType.RUN if msg.after:
+                self.handleGraph(msg)
+            case ActionType.RUN:
+                self.track(msg)
+                self.handleRun(msg)
+            case ActionType.CONT:
+                self.track(msg)
+                self.handleRun(msg)
+            case ActionType.KILL:
+                self.handleKill(msg)
+            case ActionType.DONE:
+                self.handleDone(msg)
+            case ActionType.FAILED:
+                self.handleFailed(msg)
+            case ActionType.RETRY:
+                self.handleRetry(msg)
+            case ActionType.STARTED:
+                self.emit("started", msg.job, wait=time.time() - msg.t)
+            case ActionType.WATCH:
+                self.watchers = msg.data["watchers"]
+                if msg.data.get("status") and self.eventqueue is not None:
+                    # a new watcher gets the status in line with the events
+                    self.eventqueue.put({"status": self.get_status()})
+            case ActionType.NOTIFY:
+                self.notifier.submit(msg.data)
+            case ActionType.CLEAN:
+                self.handleCleanup(msg)
+            case ActionType.RELOAD:
+                self.reloadConfig()
+            case ActionType.END:
+                self.ended(msg.id)
+
+    def replayJournal(self) -> None:
+        """
+        Start journaling, resuming the messages that the previous run of the
+        server didn't finish.
+        """
+        if not self.journal_enabled:
+            return
+        self.journal = Journal()
+        msgs = self.journal.replay()
+        if msgs:
+            self.logger.info(f"resuming {len(msgs)} messages from the journal")
+        for id, msg in msgs.items():
+            failures = msg.pop("failures")
+            # still in the journal under their id
+            self.dispatch(
+                Msg(
+                    action=ActionType.RUN,
+                    data={"failures": failures} if failures else {},
+                    id=id,
+                    **msg,
+                )
+            )
+
+    def track(self, msg: Msg) -> None:
+        """
+        Journal a message that was accepted or moved on in its chain.
+        """
+        if self.journal is None:
+            return
+        if not msg.id:
+            msg.id = self.journal.accept(
+                {
+                    "jobs": list(msg.jobs),
+                    "notifications": list(msg.notifications),
+                    "index": msg.index,
+                    "origin": msg.origin,
+                    "t": msg.t,
+                }
+            )
+        else:
+            self.inflight.pop(msg.id, None)
+            self.journal.advance(msg.id, msg.index)
+        self.journaled()
+
+    def ended(self, id: int) -> None:
+        """
+        Journal that nothing is left to run of a message, because its chain
+        finished, it was coalesced into another one or it was killed.
+        """
+        if self.journal is None or not id:
+            return
+        self.inflight.pop(id, None)
+        self.journal.end(id)
+        self.journaled()
+
+    def journaled(self) -> None:
+        if not self.journal_fsync_interval:
+            self.journal.flush()
+        elif not self.journal_dirty:
+            self.journal_dirty = True
+            self.callLater(self.journal_fsync_interval, self.syncJournal)
+
+    def syncJournal(self) -> None:
+        self.journal_dirty = False
+        if self.journal is not None:
+            self.journal.flush()
+
+    def emit(self, event: str, job: str, **details) -> None:
+        """
+        Publish an event to the watchers, if there are any.
+        """
+        if self.watchers and self.eventqueue is not None:
+            self.eventqueue.put(
+                {"event": event, "job": job, "t": time.time(), **details}
+            )
+
+    def coalesced(self, msg: Msg, reason: str) -> None:
+        if msg.action == ActionType.RUN:
+            self.emit("coalesced", msg.job, reason=reason)
+
+    def changed(self) -> None:
+        """
+        Publish a snapshot shortly, gathering the changes until then.
+        """
+        if not self.dirty:
+            self.dirty = True
+            self.callLater(self.SNAPSHOT_DELAY, self.publishSnapshot)
+
+    def publishSnapshot(self) -> None:
+        """
+        Hand a copy of the statistics and status to the IPC process, which
+        answers info requests from it without asking the message worker.
+
+        Only the statistics that changed since the last snapshot are copied,
+        the IPC process merges them into the ones it has.
+        """
+        self.dirty = False
+        self.version += 1
+        statistics: Dict[str, Any] = {
+            "start": self.statistics["start"],
+            "jobs": {
+                job: copy.deepcopy(self.statistics["jobs"][job]) for job in self.touched
+            },
+        }
+        self.touched = set()
+        if self.notifier.cmd is not None:
+            statistics["notifications"] = dict(self.notifier.counters)
+        pending = self.history.pending
+        self.comqueue.put(
+            {
+                "version": self.version,
+                "statistics": statistics,
+                "status": self.get_status(),
+                # what the history doesn't have on disk yet, all of it once it
+                # was flushed since
+                "pending": {
+                    key: copy.deepcopy(pending[key])
+                    for key in self.history.touched
+                    if key in pending
+                },
+                "flushes": self.history.flushes,
+                "flushed": self.history.flushed,
+            }
+        )
+        self.history.touched = set()
+
+    def count(self, job: str, key: str, n: int = 1) -> None:
+        if job not in self.statistics["jobs"]:
+            self.statistics["jobs"][job] = history.jobstats()
+        self.statistics["jobs"][job][key] += n
+        self.touched.add(job)
+        self.history.count(job, key, n)
+
+    def observe(self, job: str, key: str, seconds: float) -> None:
+        if job not in self.statistics["jobs"]:
+            self.statistics["jobs"][job] = history.jobstats()
+        history.observe(self.statistics["jobs"][job][key], seconds)
+        self.touched.add(job)
+        self.history.observe(job, key, seconds)
+
+    def startTimers(self) -> None:
+        """
+        Start the periodic tasks of the message worker.
+        """
+        # finds the last row on disk for the snapshots
+        self.history.flush()
+        self.callLater(self.history_interval, self.flushHistory)
+        if self.metrics is not None:
+            self.writeMetrics()
+        self.watchConfig()
+        self.watchPaths()
+        self.startSchedules()
+        self.changed()
+
+    def startSchedules(self) -> None:
+        """
+        Start triggering the jobs of the [[schedule]] config sections,
+        replacing the schedules of an earlier config. They share the timers
+        of the message worker.
+        """
+        if [schedule.section for schedule in self.schedules] == self.periodic:
+            return
+        for schedule in self.schedules:
+            schedule.active = False
+        self.schedules = [Schedule(section) for section in self.periodic]
+        for schedule in self.schedules:
+            self.callLater(schedule.delay(), self.firePeriodic, schedule)
+
+    def firePeriodic(self, schedule: Schedule) -> None:
+        """
+        Trigger the jobs of a schedule, unless one of them is still going
+        since an earlier trigger.
+        """
+        if not schedule.active:
+            return
+        self.callLater(schedule.delay(), self.firePeriodic, schedule)
+        for job in schedule.jobs:
+            job = self.checkregex(job)
+            if self.busy(job):
+                self.logger.info(f"{job}: still going, skipping scheduled trigger")
+                self.changed()
+                self.count(job, "busy")
+                return
+        self.dispatch(
+            Msg(
+                action=ActionType.RUN,
+                jobs=list(schedule.jobs),
+                notifications=list(schedule.notifications),
+                origin=schedule.origin,
+            )
+        )
+
+    def busy(self, job: str) -> bool:
+        """
+        Whether a run of the job is running, waiting or held back.
+        """
+        return (
+            self.scheduler.active(job)
+            or job in self.scheduler.waiting
+            or job in self.debouncing
+            or job in self.deferred
+            or job in self.pressured
+            or job in self.graph.waiting
+        )
+
+    def flushHistory(self) -> None:
+        self.history.flush()
+        self.changed()
+        self.callLater(self.history_interval, self.flushHistory)
+
+    def writeMetrics(self) -> None:
+        """
+        Hand a snapshot to the metrics writer, which renders it in its own
+        thread.
+        """
+        if self.metrics is None:
+            # disabled by a reload
+            return
+        self.metrics.submit(
+            {
+                "jobs": copy.deepcopy(self.statistics["jobs"]),
+                "workers": sum(item.is_alive() for item in self.data.values()),
+                "running": len(self.scheduler.running),
+                "waiting": len(self.scheduler.waiting),
+                "queues": {job: item.q.qsize() for job, item in self.data.items()},
+                "notifications": dict(self.notifier.counters),
+            }
+        )
+        self.callLater(self.metrics_interval, self.writeMetrics)
 
     def get_status(self):
         retval = {}
         for key, value in self.data.items():
-            retval[key] = {"queuesize": value.q.qsize(), "uptime": value.t}
+            state = "running" if self.scheduler.active(key) else "idle"
+            if state == "running" and not value.gate.is_set():
+                state = "paused"
+            retval[key] = {
+                "queuesize": value.q.qsize(),
+                "uptime": value.t,
+                "state": state,
+                "class": self.jobclass.get(key, DEFAULT_CLASS["name"]),
+            }
+        for key, item in self.scheduler.waiting.items():
+            retval[key] = {
+                "queuesize": len(item.msgs),
+                "uptime": item.t,
+                "state": "waiting",
+                "class": item.name,
+                # when it started waiting for a slot
+                "waiting": item.t,
+            }
+        for state, held in (
+            ("debouncing", self.debouncing),
+            ("deferred", self.deferred),
+            ("pressure", self.pressured),
+            ("pending", self.graph.waiting),
+        ):
+            for key, hitem in held.items():
+                if key not in retval:
+                    retval[key] = {
+                        "queuesize": 0,
+                        "uptime": hitem.t,
+                        "state": state,
+                        "class": self.jobclass.get(key, DEFAULT_CLASS["name"]),
+                    }
+                elif retval[key]["state"] == "idle":
+                    retval[key]["state"] = state
+        for key, row in retval.items():
+            breaker = self.breakerOf(key)
+            if breaker is not None:
+                row["breaker"] = breaker.describe()
         return retval
 
+    def jobOptions(self, job: str) -> Dict[str, Any]:
+        """
+        Options of the first [[jobs]] config section matching the job.
+        """
+        if job not in self._jobOptions:
+            self._jobOptions[job] = next(
+                (opts for opts in self.jobs if re.search(opts["pattern"], job)), {}
+            )
+        return self._jobOptions[job]
+
+    def breakerOf(self, job: str) -> Optional[Breaker]:
+        """
+        The breaker the job shares, the one its [[jobs]] config section names
+        or else the first [[breakers]] config section matching it.
+        """
+        name = self.jobOptions(job).get("breaker")
+        if name is None:
+            name = next(
+                (
+                    section["name"]
+                    for section in self.breakerSections
+                    if re.search(section.get("pattern", "(?!)"), job)
+                ),
+                None,
+            )
+        return self.breakers.get(name) if name is not None else None
+
+    def members(self, breaker: Breaker) -> List[str]:
+        """
+        The jobs of the breaker that have a run going.
+        """
+        return [
+            job
+            for job, item in self.data.items()
+            if item.is_alive()
+            and self.scheduler.active(job)
+            and self.breakerOf(job) is breaker
+        ]
+
+    def tripBreaker(self, breaker: Breaker) -> None:
+        """
+        Open a breaker, pausing its jobs before their next attempt until the
+        backoff is over.
+        """
+        delay = breaker.open()
+        members = self.members(breaker)
+        self.logger.warning(
+            f"breaker {breaker.name} open, pausing {members} for {delay:.1f}s"
+        )
+        for job, item in self.data.items():
+            # idle ones too, for the runs they get meanwhile
+            if self.breakerOf(job) is breaker:
+                item.gate.clear()
+        self.emit("breaker", breaker.name, state="open")
+        if breaker.trips == 1:
+            # the failures of the jobs were notified as usual until now
+            self.sendNotification(
+                job=f"breaker {breaker.name}",
+                msg=f"opened after {breaker.threshold} failures, "
+                f"pausing {', '.join(members)}",
+            )
+        self.callLater(delay, self.probeBreaker, breaker, breaker.generation)
+
+    def probeBreaker(self, breaker: Breaker, generation: int) -> None:
+        """
+        Let one job of an open breaker through to see whether the others can
+        follow, closing it right away if none has a run going.
+        """
+        if breaker.generation != generation:
+            return
+        self.changed()
+        members = self.members(breaker)
+        if not members:
+            self.closeBreaker(breaker)
+            return
+        probe = members[0]
+        self.logger.info(f"breaker {breaker.name} half-open, probing with {probe}")
+        breaker.halfOpen(probe)
+        self.emit("breaker", breaker.name, state="half-open")
+        self.data[probe].gate.set()
+        # it may still be waiting to retry
+        self.data[probe].wake.set()
+
+    def closeBreaker(self, breaker: Breaker) -> None:
+        """
+        Close a breaker, letting its paused jobs go at random times within
+        its spread rather than all at once.
+        """
+        breaker.close()
+        self.logger.info(f"breaker {breaker.name} closed")
+        self.emit("breaker", breaker.name, state="closed")
+        for job, item in self.data.items():
+            if not item.gate.is_set() and self.breakerOf(job) is breaker:
+                self.callLater(
+                    random.uniform(0, breaker.spread),
+                    self.resumeJob,
+                    breaker,
+                    job,
+                    breaker.generation,
+                )
+
+    def resumeJob(self, breaker: Breaker, job: str, generation: int) -> None:
+        if breaker.generation != generation or job not in self.data:
+            # opened again meanwhile, or the worker is gone
+            return
+        self.changed()
+        self.data[job].gate.set()
+        self.data[job].wake.set()
+
+    def handleGraph(self, msg: Msg) -> None:
+        """
+        Trigger the jobs of a DAG submission that don't come after any other,
+        the rest wait in the graph until the jobs they come after finished.
+        """
+        keys = [self.checkregex(job) for job in msg.jobs]
+        try:
+            roots, joined = self.graph.add(keys, msg)
+        except ValueError as e:
+            self.logger.error(f"ignoring {msg}: {e}")
+            return
+        for i in joined:
+            self.logger.debug(f"{keys[i]}: joined the pending run")
+            self.count(keys[i], "total")
+            self.emit("coalesced", keys[i], reason="pending")
+        for i in roots:
+            self.dispatch(
+                Msg(
+                    action=ActionType.RUN,
+                    jobs=[msg.jobs[i]],
+                    notifications=[msg.notifications[i]],
+                    origin=msg.origin,
+                    t=msg.t,
+                )
+            )
+
+    def release(self, items: List[joinitem]) -> None:
+        """
+        Trigger the jobs of the graph that have nothing left to wait for.
+        """
+        for item in items:
+            self.logger.debug(f"{item.job}: done waiting for the jobs it comes after")
+            self.dispatch(
+                Msg(
+                    action=ActionType.RUN,
+                    jobs=[item.job],
+                    notifications=[item.notification],
+                    origin=item.origin,
+                )
+            )
+
+    def priorityClass(self, msg: Msg) -> Dict[str, Any]:
+        """
+        The first [[classes]] config section matching the origin and the job
+        of a message.
+        """
+        for cls in self.classes:
+            if re.search(cls.get("origin", ""), msg.origin or "") and re.search(
+                cls.get("pattern", ""), msg.job
+            ):
+                return cls
+        return DEFAULT_CLASS
+
     def handleRun(self, msg) -> None:
         msg.job = self.checkregex(msg.job)
-        if msg.job not in self.statistics["jobs"]:
-            self.statistics["jobs"][msg.job] = {"total": 0, "run": 0}
-        self.statistics["jobs"][msg.job]["total"] += 1
-        if msg.job not in self.data or not self.data[msg.job].p.is_alive():
+        self.jobclass[msg.job] = self.priorityClass(msg)["name"]
+        self.count(msg.job, "total")
+        options = self.jobOptions(msg.job)
+        if options.get("debounce") and self.debounce(
+            msg, options["debounce"], options.get("leading", False)
+        ):
+            return
+        self.submit(msg)
+
+    def debounce(self, msg: Msg, window: float, leading: bool) -> bool:
+        """
+        Hold back triggers of a job until there were none for window seconds,
+        then let a single one through. With leading, the first trigger goes
+        through at once and the rest are held back. Returns whether the message
+        was held back.
+        """
+        item = self.debouncing.get(msg.job)
+        if item is None:
+            self.debouncing[msg.job] = item = holditem(time.monotonic() + window)
+            self.callLater(window, self.flushDebounce, msg.job, item)
+            if leading:
+                return False
+        item.deadline = time.monotonic() + window
+        if not item.msgs:
+            self.logger.debug(f"{msg.job}: debouncing for {window}s")
+            item.msgs.append(msg)
+            return True
+        self.logger.debug(f"{msg.job}: debounced")
+        self.count(msg.job, "debounced")
+        self.coalesced(msg, "debounce")
+        if not item.fold(msg):
+            self.ended(msg.id)
+        return True
+
+    def flushDebounce(self, job: str, item: holditem) -> None:
+        if self.debouncing.get(job) is not item:
+            # dropped by a kill
+            return
+        self.changed()
+        delay = item.deadline - time.monotonic()
+        if delay > 0:
+            self.callLater(delay, self.flushDebounce, job, item)
+            return
+        del self.debouncing[job]
+        for msg in item.msgs:
+            self.submit(msg)
+
+    def queued(self, job: str) -> bool:
+        """
+        Whether a run of the job is waiting to start.
+        """
+        if job in self.scheduler.waiting:
+            return True
+        return (
+            job in self.data
+            and self.data[job].is_alive()
+            and not self.data[job].empty()
+        )
+
+    def ratelimit(self, msg: Msg) -> bool:
+        """
+        Defer a new run of the job until the rate limit allows it, later
+        triggers are folded into the deferred run. Returns whether the message
+        was held back.
+        """
+        if msg.job in self.deferred:
+            self.coalesced(msg, "deferred")
+            if not self.deferred[msg.job].fold(msg):
+                self.ended(msg.id)
+            return True
+        if msg.action != ActionType.RUN or self.queued(msg.job):
+            return False
+        if msg.job not in self.buckets:
+            self.buckets[msg.job] = TokenBucket.from_options(self.jobOptions(msg.job))
+        bucket = self.buckets[msg.job]
+        if bucket is None:
+            return False
+        delay = bucket.take()
+        if delay == 0:
+            return False
+        self.logger.debug(f"{msg.job}: rate limited, deferring for {delay:.2f}s")
+        self.count(msg.job, "deferred")
+        item = self.deferred[msg.job] = holditem(time.monotonic() + delay, [msg])
+        self.callLater(delay, self.flushDeferred, msg.job, item)
+        return True
+
+    def flushDeferred(self, job: str, item: holditem) -> None:
+        if self.deferred.get(job) is not item:
+            # dropped by a kill
+            return
+        self.changed()
+        bucket = self.buckets[job]
+        delay = bucket.take() if bucket is not None else 0
+        if delay > 0:
+            self.callLater(delay, self.flushDeferred, job, item)
+            return
+        for msg in self.deferred.pop(job).msgs:
+            if not self.hold(msg):
+                self.enqueue(msg)
+
+    def hold(self, msg: Msg) -> bool:
+        """
+        Hold back a new run of a silent or low priority job while the system
+        is under pressure, later triggers are folded into it. Returns whether
+        the message was held back.
+        """
+        if msg.job in self.pressured:
+            self.coalesced(msg, "pressure")
+            if not self.pressured[msg.job].fold(msg):
+                self.ended(msg.id)
+            return True
+        if (
+            msg.action != ActionType.RUN
+            or not self.pressure.enabled
+            or self.queued(msg.job)
+        ):
+            return False
+        if msg.notification and self.priorityClass(msg).get("priority", 0) >= 0:
+            return False
+        readings = self.pressure.high()
+        if not readings:
+            return False
+        self.logger.info(f"{msg.job}: holding back, under pressure {readings}")
+        self.count(msg.job, "held")
+        self.pressured[msg.job] = holditem(0, [msg])
+        if not self.pressure_checking:
+            self.pressure_checking = True
+            self.callLater(self.pressure_interval, self.checkPressure)
+        return True
+
+    def checkPressure(self) -> None:
+        """
+        Let the held back runs in once the pressure dropped.
+        """
+        if self.pressured and self.pressure.high():
+            self.callLater(self.pressure_interval, self.checkPressure)
+            return
+        self.pressure_checking = False
+        self.changed()
+        pressured, self.pressured = self.pressured, {}
+        for job, item in pressured.items():
+            self.logger.info(f"{job}: letting in after {time.time() - item.t:.1f}s")
+            self.observe(job, "pressure", time.time() - item.t)
+            for msg in item.msgs:
+                self.enqueue(msg)
+
+    def submit(self, msg: Msg) -> None:
+        """
+        Pass the message through the rate limit and the pressure check, then
+        on to its worker.
+        """
+        if self.ratelimit(msg) or self.hold(msg):
+            return
+        self.enqueue(msg)
+
+    def enqueue(self, msg: Msg) -> None:
+        """
+        Hand the message to the job's worker or wait for a free slot.
+        """
+        if (
+            msg.action == ActionType.RUN
+            and msg.job in self.scheduler.retrying
+            and msg.job in self.data
+        ):
+            # the retry starts after the trigger, so it takes the trigger's
+            # place instead of being followed by another run
+            self.logger.debug(f"{msg.job}: retrying right away")
+            self.coalesced(msg, "retrying")
+            self.data[msg.job].wake.set()
+            if msg.cont():
+                self.deliver(msg)
+            else:
+                self.ended(msg.id)
+            return
+        cls = self.priorityClass(msg)
+        if msg.job in self.scheduler.waiting:
+            self.logger.debug(f"{msg.job}: already waiting for a slot")
+            self.coalesced(msg, "waiting")
+            item = self.scheduler.waiting[msg.job]
+            item.promote(cls.get("priority", 0), cls["name"])
+            if msg.cont():
+                item.msgs.append(msg)
+            else:
+                self.ended(msg.id)
+            return
+        if not self.scheduler.holds(msg.job):
+            self.logger.debug(f"{msg.job}: waiting for a slot")
+            self.scheduler.wait(msg.job, msg, cls.get("priority", 0), cls["name"])
+            self.schedule()
+            return
+        self.deliver(msg)
+
+    def schedule(self) -> None:
+        """
+        Hand waiting jobs to their workers as long as there are free slots.
+        """
+        for job, msgs in self.scheduler.admit():
+            self.logger.debug(f"{job}: got a slot")
+            for msg in msgs:
+                if msg.action == ActionType.RETRY:
+                    self.grant(job)
+                else:
+                    self.deliver(msg)
+            if not self.scheduler.running.get(job):
+                self.scheduler.drop(job)
+
+    def deliver(self, msg: Msg) -> None:
+        """
+        Put a message on the queue of its job's worker, if nothing is queued
+        yet it will run, otherwise it is coalesced into the queued run.
+        """
+        if msg.job not in self.data or not self.data[msg.job].is_alive():
             self.logger.debug(f"{msg.job}: doesn't exist or finished, creating")
-            q: Queue[Msg] = Queue()
-            e = Event()
-            p = Process(
-                target=self.runworkerFactory(),
-                args=(q, e, self.timeout, msg.job),
-            )
-            p.start()
-            self.data[msg.job] = workeritem(p, q, e, time.time())
+            self.data[msg.job] = self.createWorker(msg.job)
+            # runs handed to a previous worker are not coming back
+            self.scheduler.running[msg.job] = 0
         qsize = self.data[msg.job].q.qsize()
         self.logger.debug(f"{msg.job}: approx queue size {qsize}")
         self.data[msg.job].t = time.time()
-        if self.data[msg.job].q.empty():
+        if self.data[msg.job].empty():
             self.logger.debug(f"{msg.job}: empty, adding new")
-            self.data[msg.job].q.put(msg)
-            self.statistics["jobs"][msg.job]["run"] += 1
+            self.data[msg.job].put(msg)
+            if msg.id:
+                self.inflight[msg.id] = msg.job
+            if msg.action == ActionType.RUN:
+                self.scheduler.acquire(msg.job)
+                self.count(msg.job, "run")
             return
         self.logger.debug(f"{msg.job} already queued")
+        self.coalesced(msg, "queued")
         if msg.cont():
             self.logger.debug(f"{msg.job}: adding CONT")
-            self.data[msg.job].q.put(msg)
+            self.data[msg.job].put(msg)
+            if msg.id:
+                self.inflight[msg.id] = msg.job
+        else:
+            self.ended(msg.id)
+
+    def advance(self, msg: Msg) -> None:
+        """
+        Hand a message a worker is done with back for the next job of its
+        chain, if there is one.
+        """
+        if msg.next():
+            # the failures of the job that was resumed are not the next one's
+            msg.data = {}
+            self.post(msg)
+        elif msg.id:
+            self.post(Msg(action=ActionType.END, id=msg.id))
+
+    def createWorker(self, job: str) -> workeritem:
+        q: Queue[Msg] = WORKERS.Queue()
+        e = WORKERS.Event()
+        wake = WORKERS.Event()
+        gate = WORKERS.Event()
+        breaker = self.breakerOf(job)
+        if breaker is None or not breaker.holds(job):
+            gate.set()
+        slot = WORKERS.Event()
+        slot.set()
+        pgid = WORKERS.Value("i", 0, lock=False)
+        configs: Queue[Tuple[int, Dict[str, Any]]] = WORKERS.Queue()
+        p = WORKERS.Process(
+            target=runworker,
+            args=(
+                self,
+                logging.getLogger().level,
+                self.jobConfig(job),
+                q,
+                e,
+                wake,
+                gate,
+                slot,
+                pgid,
+                configs,
+                self.timeout,
+                job,
+            ),
+        )
+        p.start()
+        return workeritem(p, q, e, wake, gate, slot, pgid, configs, time.time())
 
-    def handleCleanup(self) -> None:
+    def post(self, msg: Msg) -> None:
+        """
+        Hand a message from a job worker back to the message worker.
+        """
+        self.q.put(msg)
+
+    def handleDone(self, msg: Msg) -> None:
+        if msg.data.get("skipped"):
+            self.count(msg.job, "skipped")
+            self.emit("skipped", msg.job)
+        elif msg.data:
+            self.recordRun(msg)
+            self.emit("finished", msg.job, duration=msg.data["duration"])
+        if "fingerprint" in msg.data:
+            self.inputs[msg.job] = msg.data["fingerprint"]
+        breaker = self.breakerOf(msg.job)
+        if breaker is not None and breaker.state != "closed" and "attempts" in msg.data:
+            # whatever the jobs were failing on is back
+            self.closeBreaker(breaker)
+        if msg.data:
+            self.release(self.graph.finished(msg.job, msg.data["start"]))
+        self.scheduler.release(msg.job)
+        self.schedule()
+
+    def recordRun(self, msg: Msg) -> None:
+        """
+        Count a finished run from what its worker reported.
+        """
+        run = msg.data
+        self.count(msg.job, "success")
+        self.count(msg.job, "retries", run["attempts"] - 1)
+        self.observe(msg.job, "duration", run["duration"])
+        self.observe(msg.job, "wait", run["start"] - msg.t)
+        self.observe(msg.job, "latency", run["end"] - msg.t)
+
+    def handleFailed(self, msg: Msg) -> None:
+        if self.journal is not None and msg.id:
+            self.journal.fail(msg.id)
+            self.journaled()
+        self.count(msg.job, "failure")
+        self.observe(msg.job, "duration", msg.data["duration"])
+        self.emit("failed", msg.job, duration=msg.data["duration"])
+        breaker = self.breakerOf(msg.job)
+        if breaker is not None and breaker.failed(msg.job):
+            self.tripBreaker(breaker)
+        item = self.data.get(msg.job)
+        if item is not None and not item.slot.is_set():
+            # the worker gave its slot up until it retries, unless it was
+            # killed and replaced meanwhile
+            self.scheduler.backoff(msg.job)
+            self.schedule()
+
+    def handleRetry(self, msg: Msg) -> None:
+        """
+        Let a job that is done waiting to retry wait for a slot again.
+        """
+        if msg.job not in self.scheduler.retrying:
+            # killed meanwhile
+            return
+        if self.scheduler.holds(msg.job):
+            # admitted meanwhile for a new run
+            self.grant(msg.job)
+            return
+        if msg.job in self.scheduler.waiting:
+            self.scheduler.waiting[msg.job].msgs.append(msg)
+        else:
+            cls = self.priorityClass(msg)
+            self.scheduler.wait(msg.job, msg, cls.get("priority", 0), cls["name"])
+        self.schedule()
+
+    def grant(self, job: str) -> None:
+        """
+        Hand the slot of an admitted job back to its worker waiting to retry.
+        """
+        self.scheduler.resume(job)
+        if job in self.data:
+            self.data[job].slot.set()
+
+    def handleCleanup(self, msg: Msg) -> None:
         self.logger.debug(f"cleanup underway, {self.data.keys()}")
         toclean = []
         for key, val in self.data.items():
-            if not val.p.is_alive():
+            if not val.is_alive():
                 toclean.append(key)
 
         for key in toclean:
             del self.data[key]
+            if not self.busy(key):
+                # set again by its next trigger
+                self.jobclass.pop(key, None)
+            self.emit("cleaned", key)
+        for id, job in list(self.inflight.items()):
+            if job not in self.data:
+                # left in the queue of a worker that is gone
+                self.ended(id)
+        for key in msg.jobs:
+            if key not in self.data:
+                # the worker has exited, whatever it still had queued won't run
+                self.scheduler.drop(key)
         self.logger.info(f"cleanup finished, {self.data.keys()}")
+        self.schedule()
 
     def handleKill(self, msg) -> None:
         for job in msg.jobs:
             if job in self.data:
-                self.data[job].e.set()
+                item = self.data[job]
+                item.e.set()
+                item.wake.set()
+                item.gate.set()
+                item.slot.set()
+                pgid = item.pgid.value
+                if pgid and self.signalGroup(pgid, signal.SIGTERM):
+                    self.logger.info(f"{job}: sent SIGTERM to process group {pgid}")
+                    self.callLater(self.kill_grace, self.escalateKill, job, item, pgid)
+            if job in self.scheduler.waiting:
+                for waiting in self.scheduler.waiting[job].msgs:
+                    self.ended(waiting.id)
+            self.scheduler.drop(job)
+            for held in (self.debouncing, self.deferred, self.pressured):
+                if job in held:
+                    # later triggers start over instead of being folded into
+                    # a run that is gone
+                    for heldmsg in held.pop(job).msgs:
+                        self.ended(heldmsg.id)
+            self.emit("killed", job)
+            self.release(self.graph.cancel(job))
+            breaker = self.breakerOf(job)
+            if breaker is not None and breaker.probe == job:
+                # another one has to probe
+                self.probeBreaker(breaker, breaker.generation)
         self.logger.debug(f"remaining jobs: {self.data.keys()}")
 
+    def escalateKill(self, job: str, item, pgid: int) -> None:
+        """
+        SIGKILL a process group that outlived its grace period, unless its
+        command ended and the pgid may belong to someone else by now.
+        """
+        if item.pgid.value != pgid:
+            return
+        if self.signalGroup(pgid, signal.SIGKILL):
+            self.logger.info(f"{job}: sent SIGKILL to process group {pgid}")
+
+    def signalGroup(self, pgid: int, sig: int) -> bool:
+        """
+        Signal a command's process group, returns False if it's gone.
+        """
+        try:
+            os.killpg(pgid, sig)
+        except ProcessLookupError:
+            return False
+        except OSError as e:
+            self.logger.error(f"failed to signal process group {pgid}: {e}")
+            return False
+        return True
+
     def sendNotification(
         self,
         job: str = "",
@@ -154,50 +1431,164 @@ class CommandWorker:
         errcode: int = -1000,
         msg: str = "",
     ) -> None:
-        if self.notification_cmd is None:
+        """
+        Hand a notification to the notifier of the message worker, which
+        sends it without holding up the worker.
+        """
+        if self.notifier.cmd is None:
             return
-        try:
-            self.logger.debug(f"sending message {job=}, {msg=}, {urgency=}, {errcode=}")
-            subprocess.run(
-                shlex.split(
-                    self.notification_cmd.format(
-                        job=job,
-                        origin=origin,
-                        urgency=urgency,
-                        msg=msg,
-                        errcode=errcode,
-                    )
-                ),
-                env=os.environ.copy(),
+        self.post(
+            Msg(
+                action=ActionType.NOTIFY,
+                data={
+                    "job": job,
+                    "origin": origin,
+                    "urgency": urgency,
+                    "errcode": errcode,
+                    "msg": msg,
+                },
             )
-        except Exception as e:
-            self.logger.error(f"failed sending notification command with error: {e}")
+        )
 
-    def checkregex(self, job) -> str:
-        self.logger.debug(f"checking: {self.filters}")
-        for item in self.filters:
-            self.logger.debug(
-                f"pattern: {item['pattern']}, subsitute: {item['substitute']}, input: {job}"
+    def handleFailure(
+        self,
+        msg: Msg,
+        logger: logging.Logger,
+        error_counter: int,
+        returncode: int,
+        stdout: bytes,
+        stderr: bytes,
+    ) -> int:
+        """
+        Log a run with a non-zero exit code and notify if needed, returns the
+        updated error counter.
+        """
+        error_counter += 1
+        logger.error(f"{returncode=}, {stdout=}, {stderr=}, {error_counter=}")
+        if error_counter >= self.notify_on_counter and msg.notification:
+            # the tails can start in the middle of a character
+            out = stdout.decode("utf-8", "replace")
+            err = stderr.decode("utf-8", "replace")
+            self.sendNotification(
+                job=msg.job,
+                origin=msg.origin,
+                msg=f"c:{error_counter}|{err} - {out}",
+                errcode=returncode,
+            )
+            error_counter = 0
+        return error_counter
+
+    def handleError(
+        self, msg: Msg, logger: logging.Logger, error_counter: int, error: Exception
+    ) -> int:
+        """
+        Log a run that could not be completed and notify if needed, returns the
+        updated error counter.
+        """
+        error_counter += 1
+        logger.error(f"{msg.job}'s subprocess failed with {error}")
+        if error_counter >= self.notify_on_counter and msg.notification:
+            self.sendNotification(
+                job=msg.job,
+                origin=msg.origin,
+                msg=f"subprocess failed with {error}",
+            )
+            error_counter = 0
+        return error_counter
+
+    def openCapture(self, job: str) -> Capture:
+        """
+        Capture for a run of job, with the output options of its [[jobs]]
+        section falling back to the global ones.
+        """
+        options = {**self.output, **self.jobOptions(job)}
+        logfile = None
+        if options["output_file"]:
+            try:
+                logfile = RotatingFile(
+                    output_path(job),
+                    options["output_file_size_kb"] * 1024,
+                    options["output_file_backups"],
+                )
+            except OSError as e:
+                self.logger.error(f"can't open output file for {job}: {e}")
+        capture = Capture(options["output_tail_kb"] * 1024, logfile)
+        capture.start(job)
+        return capture
+
+    def fingerprint(self, job: str) -> Optional[str]:
+        """
+        Fingerprint of the inputs the [[jobs]] config section of the job
+        declares, None if it declares none or they can't be read.
+        """
+        options = self.jobOptions(job)
+        if not options.get("inputs"):
+            return None
+        if job not in self._fingerprints:
+            self._fingerprints[job] = Fingerprint(
+                options["inputs"], options.get("inputs_recursive", False)
             )
-            newjob = re.sub(item["pattern"], item["substitute"], job)
-            if newjob != job:
-                self.logger.info(f"regex rewrite {job} -> {newjob}")
-                return newjob
-        return job
+        return self._fingerprints[job].take()
+
+    def skip(
+        self,
+        msg: Msg,
+        fingerprint: Optional[str],
+        last: Optional[str],
+        logger: logging.Logger,
+    ) -> bool:
+        """
+        Whether to skip a run as its inputs didn't change since the last
+        successful one, reporting it as done if so.
+        """
+        if fingerprint is None or fingerprint != (last or self.inputs.get(msg.job)):
+            return False
+        logger.info(f"{msg.job}: inputs unchanged, skipping the run")
+        self.post(
+            Msg(
+                action=ActionType.DONE,
+                jobs=[msg.job],
+                t=msg.t,
+                data={"skipped": True, "start": time.time()},
+            )
+        )
+        return True
+
+    def checkregex(self, job) -> str:
+        newjob = self.filters.rewrite(job)
+        if newjob != job:
+            self.logger.info(f"regex rewrite {job} -> {newjob}")
+        return newjob
 
     def runworkerFactory(self):
         """
         Factory for handling each type of job.
         """
 
-        def handlejobs(msg: Msg, e, logger) -> None:
-            retry_timeout_index = -1
-            error_counter = 0
+        def handlejobs(msg: Msg, e, wake, gate, slot, pgid, logger) -> Dict[str, Any]:
+            """
+            Run the job until it succeeds or is killed, returns the timings of
+            the attempts.
+            """
+            run: Dict[str, Any] = {"start": time.time(), "attempts": 0}
             if msg.notification:
                 retry_sequence = self.retry_sequence
             else:
                 retry_sequence = self.retry_sequence_silent
+            # a run resumed from the journal carries on with the retries it was at
+            error_counter = msg.data.get("failures", 0)
+            retry_timeout_index = min(error_counter, len(retry_sequence) - 1) - 1
             while True:
+                if not gate.is_set():
+                    logger.info(f"{msg.job}: paused by its breaker")
+                    gate.wait()
+                if not slot.is_set() and not e.is_set():
+                    self.post(
+                        Msg(action=ActionType.RETRY, jobs=[msg.job], origin=msg.origin)
+                    )
+                    slot.wait()
+                # whatever cut the wait short is taken care of by this attempt
+                wake.clear()
                 if e.is_set():
                     break
                 if retry_timeout_index + 1 < len(retry_sequence):
@@ -205,50 +1596,73 @@ class CommandWorker:
                 success = True
                 logger.debug(msg)
                 logger.debug(f"running job: {msg.job} with timeout {self.job_timeout}")
+                capture = self.openCapture(msg.job)
+                started = time.monotonic()
+                run["attempts"] += 1
                 try:
-                    proc = subprocess.run(
+                    # in its own session, so a kill reaches all its children
+                    with subprocess.Popen(
                         shlex.split(msg.job),
-                        capture_output=True,
-                        timeout=self.job_timeout,
-                    )
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.PIPE,
+                        start_new_session=True,
+                    ) as proc:
+                        pgid.value = proc.pid
+                        if e.is_set():
+                            # killed before the group could be seen
+                            self.signalGroup(proc.pid, signal.SIGKILL)
+                        communicate(proc, capture, self.job_timeout)
+                    duration = time.monotonic() - started
+                    if e.is_set():
+                        logger.info(f"{msg.job} was killed")
+                        break
                     if proc.returncode != 0:
                         success = False
-                        error_counter += 1
-                        logger.error(
-                            f"{proc.returncode=}, {proc.stdout=}, {proc.stderr=}, {error_counter=}"
+                        error_counter = self.handleFailure(
+                            msg,
+                            logger,
+                            error_counter,
+                            proc.returncode,
+                            capture.stdout.tail(),
+                            capture.stderr.tail(),
                         )
-                        if error_counter >= self.notify_on_counter and msg.notification:
-                            self.sendNotification(
-                                job=msg.job,
-                                origin=msg.origin,
-                                msg=f"c:{error_counter}|{proc.stderr.decode('utf-8')} - {proc.stdout.decode('utf-8')}",
-                                errcode=proc.returncode,
-                            )
-                            error_counter = 0
                 except Exception as error:
                     success = False
-                    error_counter += 1
-                    logger.error(f"{msg.job}'s subprocess failed with {error}")
-                    if error_counter >= self.notify_on_counter and msg.notification:
-                        self.sendNotification(
-                            job=msg.job,
-                            origin=msg.origin,
-                            msg=f"subprocess failed with {error}",
-                        )
-                        error_counter = 0
+                    duration = time.monotonic() - started
+                    error_counter = self.handleError(msg, logger, error_counter, error)
+                finally:
+                    pgid.value = 0
+                    capture.close()
 
                 if success:
+                    run["duration"] = duration
                     break
+                # the slot is given up while waiting, and waited for again
+                # before the next attempt
+                slot.clear()
+                self.post(
+                    Msg(
+                        action=ActionType.FAILED,
+                        jobs=[msg.job],
+                        t=msg.t,
+                        id=msg.id,
+                        data={"duration": duration},
+                    )
+                )
                 if e.is_set():
                     break
-                time.sleep(retry_sequence[retry_timeout_index])
+                if wake.wait(retry_sequence[retry_timeout_index]):
+                    wake.clear()
+            run["end"] = time.time()
+            return run
 
-        def worker(q, e, timeout, name) -> None:
-            self.retry_sequence
+        def worker(q, e, wake, gate, slot, pgid, configs, timeout, name) -> None:
             logger_name = f"{name.replace(' ','_')}_worker"
             logger = logging.getLogger(logger_name)
             counter = 0
             cont_counter = 0
+            # of the inputs at the start of the last successful run
+            last = None
             logger.debug(f"starting process for {logger_name}")
 
             while True:
@@ -257,18 +1671,51 @@ class CommandWorker:
                 try:
                     msg = q.get(timeout=timeout)
                     if msg.action == ActionType.RUN:
+                        while self.loaded != self.generation.value:
+                            # reloaded since this worker was started, the
+                            # settings are on their way
+                            generation, config = configs.get()
+                            self.applyJobConfig(config)
+                            self.loaded = generation
+                        fingerprint = self.fingerprint(name)
+                        if self.skip(msg, fingerprint, last, logger):
+                            self.advance(msg)
+                            continue
                         counter += 1
                         logger.debug(f"start run no: {counter} (CONT: {cont_counter})")
-                        handlejobs(msg, e, logger)
+                        self.post(Msg(action=ActionType.STARTED, jobs=[name], t=msg.t))
+                        run = handlejobs(msg, e, wake, gate, slot, pgid, logger)
                         logger.debug(f"finish run no: {counter} (CONT: {cont_counter})")
+                        if not e.is_set():
+                            if fingerprint is not None:
+                                run["fingerprint"] = last = fingerprint
+                            self.post(
+                                Msg(
+                                    action=ActionType.DONE,
+                                    jobs=[name],
+                                    t=msg.t,
+                                    data=run,
+                                )
+                            )
                     else:
                         cont_counter += 1
                         logger.debug(f"handling CONT no. {cont_counter}")
-                    if msg.next():
-                        self.q.put(msg)
+                    self.advance(msg)
                 except queue.Empty:
                     logger.debug(f"closing process for {logger_name}")
                     break
-            self.q.put(Msg(action=ActionType.CLEAN))
+            e.set()
+            self.post(Msg(action=ActionType.CLEAN, jobs=[name]))
 
         return worker
+
+
+def runworker(
+    worker: CommandWorker, loglevel: int, config: Dict[str, Any], *args
+) -> None:
+    """
+    Run a job worker, in a process of its own, with the settings of its job.
+    """
+    loglib.publisher_config(worker.logqueue, loglevel)
+    worker.applyJobConfig(config)
+    worker.runworkerFactory()(*args)
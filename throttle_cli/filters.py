@@ -0,0 +1,95 @@
+import logging
+import re
+from bisect import insort
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+METACHARS = set(".^$*+?{}[]\\|()")
+
+
+def literal_prefix(pattern: str) -> Optional[str]:
+    """
+    The literal text a pattern anchored with ^ has to start with, or None if
+    the pattern isn't anchored on all of its branches.
+    """
+    if not pattern.startswith("^"):
+        return None
+    depth = 0
+    inclass = False
+    escaped = False
+    for c in pattern:
+        if escaped:
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif inclass:
+            inclass = c != "]"
+        elif c == "[":
+            inclass = True
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            # ^a|b matches b anywhere
+            return None
+    prefix = []
+    for c in pattern[1:]:
+        if c in METACHARS:
+            if c in "*?{" and prefix:
+                # the last character is optional or repeated
+                prefix.pop()
+            break
+        prefix.append(c)
+    return "".join(prefix)
+
+
+class Filters:
+    """
+    Compiled [[filters]] config, rewriting a job with the first filter that
+    changes it.
+
+    Filters anchored with ^ are indexed by their literal prefix, so only those
+    that can match a job and the unanchored ones are tried. Rewrites are
+    cached.
+    """
+
+    def __init__(self, filters: List[Dict[str, str]], cachesize: int = 1024):
+        self.logger = logging.getLogger("filters")
+        self.filters: List[Tuple[re.Pattern, str]] = []
+        self.unindexed: List[int] = []
+        self.index: Dict[str, List[int]] = {}
+        for i, f in enumerate(filters):
+            self.filters.append((re.compile(f["pattern"]), f["substitute"]))
+            prefix = literal_prefix(f["pattern"])
+            if prefix:
+                self.index.setdefault(prefix, []).append(i)
+            else:
+                self.unindexed.append(i)
+        self.lengths = sorted({len(prefix) for prefix in self.index})
+        self.rewrite = lru_cache(maxsize=cachesize)(self._rewrite)
+
+    def __len__(self) -> int:
+        return len(self.filters)
+
+    def candidates(self, job: str) -> List[int]:
+        candidates = list(self.unindexed)
+        for length in self.lengths:
+            if length > len(job):
+                break
+            for i in self.index.get(job[:length], ()):
+                insort(candidates, i)
+        return candidates
+
+    def _rewrite(self, job: str) -> str:
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        for i in self.candidates(job):
+            pattern, substitute = self.filters[i]
+            if debug:
+                self.logger.debug(
+                    f"pattern: {pattern.pattern}, subsitute: {substitute}, input: {job}"
+                )
+            newjob = pattern.sub(substitute, job)
+            if newjob != job:
+                return newjob
+        return job
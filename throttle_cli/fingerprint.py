@@ -0,0 +1,84 @@
+import hashlib
+import os
+import stat
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+class Fingerprint:
+    """
+    Cheap fingerprint of input paths, to tell whether anything changed since
+    it was last taken: the inode and modification time of every path, with
+    the size of files and the link count (the number of subdirectories) of
+    directories.
+
+    Recursively, the same is taken of every directory below them, which
+    changes when an entry is added, removed or renamed, but not when a file is
+    modified in place. A directory is only listed again when its modification
+    time changed, otherwise the subdirectories it had are stat'ed again.
+    """
+
+    def __init__(self, paths: List[str], recursive: bool = False):
+        self.paths = [Path(path).expanduser() for path in paths]
+        self.recursive = recursive
+        # subdirectories of each directory, with the time it was modified then
+        self.cache: Dict[str, Tuple[int, List[str]]] = {}
+
+    def take(self) -> Optional[str]:
+        """
+        The fingerprint, None if the paths can't be read.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        cache: Dict[str, Tuple[int, List[str]]] = {}
+        try:
+            for path in self.paths:
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    digest.update(f"{path} missing\n".encode())
+                    continue
+                if not stat.S_ISDIR(st.st_mode):
+                    digest.update(
+                        f"{path} {st.st_ino} {st.st_mtime_ns} {st.st_size}\n".encode()
+                    )
+                    continue
+                digest.update(
+                    f"{path} {st.st_ino} {st.st_mtime_ns} {st.st_nlink}\n".encode()
+                )
+                if self.recursive:
+                    self.walk(str(path), st.st_mtime_ns, digest, cache)
+        except OSError:
+            return None
+        # directories that are gone are forgotten
+        self.cache = cache
+        return digest.hexdigest()
+
+    def walk(
+        self,
+        top: str,
+        mtime: int,
+        digest: "hashlib._Hash",
+        cache: Dict[str, Tuple[int, List[str]]],
+    ) -> None:
+        pending = [(top, mtime)]
+        while pending:
+            directory, mtime = pending.pop()
+            cached = self.cache.get(directory)
+            if cached is not None and cached[0] == mtime:
+                subdirectories = cached[1]
+            else:
+                with os.scandir(directory) as entries:
+                    subdirectories = sorted(
+                        entry.path
+                        for entry in entries
+                        if entry.is_dir(follow_symlinks=False)
+                    )
+            cache[directory] = (mtime, subdirectories)
+            for subdirectory in subdirectories:
+                try:
+                    st = os.lstat(subdirectory)
+                except FileNotFoundError:
+                    # removed since the listing, which changed its parent too
+                    continue
+                digest.update(f"{subdirectory} {st.st_ino} {st.st_mtime_ns}\n".encode())
+                pending.append((subdirectory, st.st_mtime_ns))
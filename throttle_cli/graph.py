@@ -0,0 +1,139 @@
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Set, Tuple
+
+from .structures import Msg
+
+
+@dataclass
+class joinitem:
+    # as submitted, the filters are applied when it's triggered
+    job: str
+    notification: int
+    origin: str
+    # the jobs it comes after, with the time their run has to start after
+    after: Dict[str, float]
+    t: float = field(default_factory=time.time)
+
+
+class Graph:
+    """
+    Jobs of DAG submissions waiting for the jobs they come after.
+
+    Jobs are waited for by name across all submissions, so a job that several
+    submissions lead to is triggered once, after each job any of them waits
+    for had a run that started after the submission. Jobs that don't come
+    after any other are left to the caller to trigger right away.
+    """
+
+    def __init__(self):
+        self.waiting: Dict[str, joinitem] = {}
+        # the jobs waiting for each job
+        self.successors: Dict[str, Set[str]] = {}
+
+    def add(self, keys: List[str], msg: Msg) -> Tuple[List[int], List[int]]:
+        """
+        Add a submission, with keys being its jobs after the filters. Returns
+        the indices of the jobs to trigger now and of the jobs that joined
+        one that was already waiting. Raises ValueError if it isn't a DAG,
+        also together with the jobs that are already waiting.
+        """
+        check(keys, msg.after)
+        successors = {key: set(keys) for key, keys in self.successors.items()}
+        for i, after in enumerate(msg.after):
+            for j in after:
+                successors.setdefault(keys[j], set()).add(keys[i])
+        if cyclic(successors):
+            raise ValueError("the jobs would wait for each other with waiting ones")
+        roots, joined = [], []
+        for i, after in enumerate(msg.after):
+            if not after:
+                roots.append(i)
+                continue
+            key = keys[i]
+            item = self.waiting.get(key)
+            if item is None:
+                self.waiting[key] = item = joinitem(
+                    msg.jobs[i], msg.notifications[i], msg.origin, {}
+                )
+            else:
+                joined.append(i)
+                item.notification = max(item.notification, msg.notifications[i])
+            for j in after:
+                # a run that started before this submission doesn't count
+                item.after[keys[j]] = max(item.after.get(keys[j], 0), msg.t)
+                self.successors.setdefault(keys[j], set()).add(key)
+        return roots, joined
+
+    def finished(self, job: str, start: float) -> List[joinitem]:
+        """
+        A run of job that started at start finished, returns the jobs that
+        have nothing left to wait for.
+        """
+        ready = []
+        pending = set()
+        for key in self.successors.pop(job, set()):
+            item = self.waiting[key]
+            if item.after[job] > start:
+                pending.add(key)
+                continue
+            del item.after[job]
+            if not item.after:
+                ready.append(self.waiting.pop(key))
+        if pending:
+            self.successors[job] = pending
+        return ready
+
+    def cancel(self, job: str) -> List[joinitem]:
+        """
+        Forget a killed job, the jobs waiting for it go on as if it finished.
+        Returns the jobs that have nothing left to wait for.
+        """
+        item = self.waiting.pop(job, None)
+        if item is not None:
+            for key in item.after:
+                self.successors[key].discard(job)
+                if not self.successors[key]:
+                    del self.successors[key]
+        return self.finished(job, float("inf"))
+
+
+def cyclic(successors: Dict[str, Set[str]]) -> bool:
+    """
+    Whether the jobs waiting for each job wait for each other in a cycle.
+    """
+    remaining: Dict[str, int] = {}
+    for keys in successors.values():
+        for key in keys:
+            remaining[key] = remaining.get(key, 0) + 1
+    ordered = [key for key in successors if key not in remaining]
+    for key in ordered:
+        for successor in successors.get(key, ()):
+            remaining[successor] -= 1
+            if remaining[successor] == 0:
+                ordered.append(successor)
+    return any(remaining.values())
+
+
+def check(keys: List[str], after: List[List[int]]) -> None:
+    """
+    Raise ValueError if the jobs and what they come after aren't a DAG.
+    """
+    if len(after) != len(keys):
+        raise ValueError("after has to list the jobs each job comes after")
+    if len(set(keys)) != len(keys):
+        raise ValueError("a job can only be given once")
+    for predecessors in after:
+        if not all(isinstance(j, int) and 0 <= j < len(keys) for j in predecessors):
+            raise ValueError(f"{predecessors} are not indices of the jobs")
+    # Kahn's algorithm, whatever can't be ordered is on a cycle
+    remaining = [len(set(predecessors)) for predecessors in after]
+    ordered = [i for i, n in enumerate(remaining) if n == 0]
+    for i in ordered:
+        for j, predecessors in enumerate(after):
+            if i in predecessors:
+                remaining[j] -= 1
+                if remaining[j] == 0:
+                    ordered.append(j)
+    if len(ordered) != len(keys):
+        raise ValueError("the jobs depend on each other in a cycle")
@@ -0,0 +1,188 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Any, Dict, Optional, Set, Tuple
+
+from xdg import BaseDirectory
+
+# upper bounds in seconds of the histogram buckets, the last bucket is open
+BOUNDS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+COUNTERS = (
+    "total",
+    "run",
+    "debounced",
+    "deferred",
+    "held",
+    "skipped",
+    "busy",
+    "success",
+    "failure",
+    "retries",
+)
+HISTOGRAMS = (
+    "duration",  # of each attempt of a run
+    "wait",  # from the trigger to the start of its run
+    "latency",  # from the trigger to the end of its run
+    "pressure",  # a run was held back by the pressure of the system
+)
+
+
+def histogram() -> Dict[str, Any]:
+    return {"counts": [0] * (len(BOUNDS) + 1), "sum": 0.0}
+
+
+def observe(hist: Dict[str, Any], seconds: float) -> None:
+    hist["counts"][bisect_left(BOUNDS, seconds)] += 1
+    hist["sum"] += seconds
+
+
+def quantile(hist: Dict[str, Any], q: float) -> Optional[float]:
+    """
+    Upper bound of the bucket the q quantile falls in, None if empty.
+    """
+    total = sum(hist["counts"])
+    if not total:
+        return None
+    seen = 0
+    for bound, count in zip(BOUNDS + (float("inf"),), hist["counts"]):
+        seen += count
+        if seen >= q * total:
+            return bound
+    return float("inf")
+
+
+def jobstats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {key: 0 for key in COUNTERS}
+    for key in HISTOGRAMS:
+        stats[key] = histogram()
+    return stats
+
+
+def merge(into: Dict[str, Any], stats: Dict[str, Any]) -> None:
+    for key in COUNTERS:
+        into[key] += stats.get(key, 0)
+    for key in HISTOGRAMS:
+        if key in stats:
+            into[key]["sum"] += stats[key]["sum"]
+            for i, count in enumerate(stats[key]["counts"]):
+                into[key]["counts"][i] += count
+
+
+class History:
+    """
+    Job statistics per minute kept in an sqlite database under
+    $XDG_STATE/throttle, so they survive restarts and can be queried for a
+    time window.
+
+    Events are aggregated in memory and written in one transaction by flush,
+    which is called periodically from the message worker.
+    """
+
+    PERIOD = 60
+
+    def __init__(self, path: Optional[Path] = None, retention_days: float = 30):
+        if path is None:
+            path = Path(BaseDirectory.xdg_state_home) / "throttle" / "statistics.db"
+        self.path = path
+        self.retention_days = retention_days
+        self.pending: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        # the last row written, rows are only ever added after it
+        self.flushed = 0
+        # pending statistics changed since the message worker last published
+        # them, and how many times they were flushed and started over
+        self.touched: Set[Tuple[int, str]] = set()
+        self.flushes = 0
+        # sqlite connections can't be shared between threads, queries run in
+        # the threads of an executor
+        self.local = threading.local()
+        self.logger = logging.getLogger("history")
+
+    def connect(self) -> sqlite3.Connection:
+        # opened on first use, in the process and thread that uses it
+        db = getattr(self.local, "db", None)
+        if db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            db = self.local.db = sqlite3.connect(self.path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS stats"
+                " (period INTEGER NOT NULL, job TEXT NOT NULL, data TEXT NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS stats_period ON stats (period)")
+        return db
+
+    def stats(self, job: str) -> Dict[str, Any]:
+        period = int(time.time()) // self.PERIOD * self.PERIOD
+        key = (period, job)
+        self.touched.add(key)
+        if key not in self.pending:
+            self.pending[key] = jobstats()
+        return self.pending[key]
+
+    def count(self, job: str, key: str, n: int = 1) -> None:
+        self.stats(job)[key] += n
+
+    def observe(self, job: str, key: str, seconds: float) -> None:
+        observe(self.stats(job)[key], seconds)
+
+    def flush(self) -> None:
+        """
+        Write the pending statistics and forget the ones out of retention.
+        """
+        pending, self.pending = self.pending, {}
+        self.flushes += 1
+        cutoff = time.time() - self.retention_days * 24 * 60 * 60
+        try:
+            db = self.connect()
+            with db:
+                db.executemany(
+                    "INSERT INTO stats VALUES (?, ?, ?)",
+                    [
+                        (period, job, json.dumps(stats, separators=(",", ":")))
+                        for (period, job), stats in pending.items()
+                    ],
+                )
+                db.execute("DELETE FROM stats WHERE period < ?", (cutoff,))
+                (self.flushed,) = db.execute("SELECT max(rowid) FROM stats").fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"failed writing statistics to {self.path}: {e}")
+
+    def query(
+        self,
+        since: float,
+        pending: Optional[Dict[Tuple[int, str], Dict[str, Any]]] = None,
+        flushed: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Statistics of the jobs since the given time, including the pending
+        ones, in the same shape as the statistics of the running server.
+
+        Another process can query with the pending statistics and last row of
+        a snapshot of the writer, rows written after it are left out so that
+        nothing is counted twice.
+        """
+        if pending is None:
+            pending, flushed = self.pending, self.flushed
+        period = int(since) // self.PERIOD * self.PERIOD
+        jobs: Dict[str, Dict[str, Any]] = {}
+        start = time.time()
+        rows = []
+        try:
+            rows = self.connect().execute(
+                "SELECT period, job, data FROM stats WHERE period >= ? AND rowid <= ?",
+                (period, flushed or 0),
+            )
+        except sqlite3.Error as e:
+            self.logger.error(f"failed reading statistics from {self.path}: {e}")
+        for p, job, data in rows:
+            merge(jobs.setdefault(job, jobstats()), json.loads(data))
+            start = min(start, p)
+        for (p, job), stats in pending.items():
+            if p >= period:
+                merge(jobs.setdefault(job, jobstats()), stats)
+                start = min(start, p)
+        return {"start": max(start, since), "jobs": jobs}
@@ -4,6 +4,8 @@ import time
 
 from prettytable import MARKDOWN, PLAIN_COLUMNS, PrettyTable
 
+from .history import BOUNDS, quantile
+
 
 def formatTable(table, format):
     if format == "markdown":
@@ -15,44 +17,138 @@ def formatTable(table, format):
     return table.get_formatted_string(format)
 
 
+def formatQuantile(hist, q):
+    """
+    The bucket of the q quantile of a histogram as "<=10s".
+    """
+    bound = quantile(hist, q)
+    if bound is None:
+        return "-"
+    if bound > BOUNDS[-1]:
+        return f">{BOUNDS[-1]:g}s"
+    return f"<={bound:g}s"
+
+
 def parse_stat(stats, format):
     maxwidth = None
     if sys.stdout.isatty():
         width, _ = os.get_terminal_size()
-        maxwidth = width - 40
+        maxwidth = max(width - 140, 20)
 
     curtime = time.time()
     total_sec = curtime - stats["start"]
     table = PrettyTable()
-    table.field_names = ["job", "run", "total", "throttle", "avg/min"]
+    table.field_names = [
+        "job",
+        "run",
+        "total",
+        "debounced",
+        "deferred",
+        "held",
+        "skipped",
+        "busy",
+        "failures",
+        "retries",
+        "throttle",
+        "avg/min",
+        "run p50",
+        "run p95",
+        "wait p95",
+        "done p95",
+    ]
     for key, val in stats["jobs"].items():
         r = val["run"]
         tot = val["total"]
-        t = total_sec / 60
-        throttle = (tot - r) / tot
+        deb = val["debounced"]
+        t = max(total_sec, 1) / 60
+        throttle = (tot - r - deb) / tot if tot else 0
         avg = r / t
-        table.add_row([key[:maxwidth], r, tot, throttle, avg])
+        table.add_row(
+            [
+                key[:maxwidth],
+                r,
+                tot,
+                deb,
+                val["deferred"],
+                val.get("held", 0),
+                val.get("skipped", 0),
+                val.get("busy", 0),
+                val["failure"],
+                val["retries"],
+                throttle,
+                avg,
+                formatQuantile(val["duration"], 0.5),
+                formatQuantile(val["duration"], 0.95),
+                formatQuantile(val["wait"], 0.95),
+                formatQuantile(val["latency"], 0.95),
+            ]
+        )
     table.sortby = "throttle"
     table.reversesort = True
     table.float_format = ".2"
     table.align["job"] = "l"
-    return formatTable(table, format)
+    result = formatTable(table, format)
+    if "datagrams" in stats and format in ("text", "plain", "markdown"):
+        datagrams = stats["datagrams"]
+        result += (
+            f"\n\ndatagrams received: {datagrams['received']}, "
+            f"dropped: {datagrams['dropped']}"
+        )
+    if stats.get("notifications") and format in ("text", "plain", "markdown"):
+        notifications = stats["notifications"]
+        result += (
+            f"\n\nnotifications sent: {notifications['sent']}, "
+            f"suppressed: {notifications['suppressed']}, "
+            f"dropped: {notifications['dropped']}"
+        )
+    return result
 
 
 def parse_status(status, format):
     maxwidth = None
     if sys.stdout.isatty():
         width, _ = os.get_terminal_size()
-        maxwidth = width - 20
+        maxwidth = max(width - 80, 20)
 
     curtime = time.time()
     table = PrettyTable()
-    table.field_names = ["job", "queue size", "uptime (s)"]
+    table.field_names = [
+        "job",
+        "state",
+        "class",
+        "queue size",
+        "uptime (s)",
+        "waited (s)",
+        "breaker",
+    ]
     for key, val in status.items():
         uptime = curtime - val["uptime"]
-        table.add_row([key[:maxwidth], val["queuesize"], uptime])
+        waited = curtime - val["waiting"] if val.get("waiting") else 0
+        table.add_row(
+            [
+                key[:maxwidth],
+                val["state"],
+                val.get("class", "default"),
+                val["queuesize"],
+                uptime,
+                waited,
+                val.get("breaker", ""),
+            ]
+        )
     table.sortby = "uptime (s)"
     table.reversesort = True
     table.float_format = ".0"
     table.align["job"] = "l"
     return formatTable(table, format)
+
+
+def parse_event(event):
+    line = f"{time.strftime('%H:%M:%S', time.localtime(event['t']))} "
+    line += f"{event['event']:<9} {event['job']}"
+    if "duration" in event:
+        line += f" ({event['duration']:.2f}s)"
+    if "reason" in event:
+        line += f" ({event['reason']})"
+    if "state" in event:
+        line += f" {event['state']}"
+    return line
@@ -0,0 +1,109 @@
+"""
+Minimal inotify bindings, enough to watch a few directories for changed files
+without a dependency. Linux only, Watcher raises OSError elsewhere.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# wd, mask, cookie, len, followed by len bytes of name
+EVENT = struct.Struct("iIII")
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def libc() -> ctypes.CDLL:
+    global _libc
+    if _libc is None:
+        name = ctypes.util.find_library("c")
+        if name is None:
+            raise OSError("libc not found")
+        _libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(_libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+    return _libc
+
+
+def check(result: int) -> int:
+    if result < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
+
+
+class Watcher:
+    """
+    Watches directories for events of mask on the files in them.
+    """
+
+    def __init__(self, *paths: Path, mask: int = IN_CLOSE_WRITE | IN_MOVED_TO):
+        self.fd = check(libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+        self.mask = mask
+        self.paths: Dict[int, Path] = {}
+        try:
+            for path in paths:
+                self.add(path)
+        except OSError:
+            self.close()
+            raise
+
+    def add(self, path: Path) -> int:
+        wd = check(
+            libc().inotify_add_watch(
+                self.fd, os.fsencode(path), ctypes.c_uint32(self.mask)
+            )
+        )
+        self.paths[wd] = Path(path)
+        return wd
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Whether there are events to read within timeout seconds.
+        """
+        return bool(select.select([self.fd], [], [], timeout)[0])
+
+    def read(self) -> List[Path]:
+        """
+        Block until there are events, returns the paths they happened to.
+        """
+        return [path for path, _ in self.events()]
+
+    def events(self) -> List[Tuple[Path, int]]:
+        """
+        Block until there are events, returns the paths they happened to with
+        the mask of each event.
+        """
+        self.wait()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if wd in self.paths:
+                events.append((self.paths[wd] / os.fsdecode(name), mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
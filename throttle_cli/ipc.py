@@ -0,0 +1,108 @@
+"""
+Framed protocol spoken over the throttle socket.
+
+Every frame is a 4 byte big-endian length followed by that many bytes of
+UTF-8 JSON. A request is {"id": ..., "method": ..., "params": ...}, the
+response to it is {"id": ..., "result": ...} or {"id": ..., "error": ...}.
+Requests without an id get no response. Connections are persistent and
+requests can be pipelined, responses come in the order of the requests.
+After a watch request has been answered with the current status, the server
+pushes {"event": ...} frames on the connection.
+
+When the server is started with --datagram, RUN and KILL messages can also be
+sent unframed as a single datagram each, without any response.
+"""
+
+# this is imported by the client for every submitted job, so only the bare
+# minimum is imported here, the server side lives in server.py
+import json
+import socket
+import struct
+
+HEADER = struct.Struct(">I")
+MAX_FRAME = 1024 * 1024
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode(obj) -> bytes:
+    data = json.dumps(obj, separators=(",", ":")).encode("utf-8")
+    return HEADER.pack(len(data)) + data
+
+
+def send_datagram(socketpath, msgs) -> bool:
+    """
+    Send messages as a single datagram without waiting. Returns False if they
+    couldn't be sent, e.g. when there is no datagram socket or its buffer is
+    full, so the caller can use the stream socket instead.
+    """
+    data = json.dumps(msgs, separators=(",", ":")).encode("utf-8")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+        sock.setblocking(False)
+        try:
+            sock.sendto(data, str(socketpath))
+        except OSError:
+            return False
+    return True
+
+
+class Client:
+    """
+    Blocking client for the framed protocol.
+    """
+
+    def __init__(self, socketpath):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(socketpath))
+        self.file = self.sock.makefile("rb")
+        self.counter = 0
+
+    def send(self, method: str, params, reply: bool = True) -> int | None:
+        request = {"method": method, "params": params}
+        if reply:
+            self.counter += 1
+            request["id"] = self.counter
+        self.sock.sendall(encode(request))
+        return request.get("id")
+
+    def read(self) -> dict:
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionError("server closed the connection")
+        (length,) = HEADER.unpack(header)
+        return json.loads(self.file.read(length))
+
+    def receive(self):
+        response = self.read()
+        if "error" in response:
+            raise ProtocolError(response["error"])
+        return response["result"]
+
+    def call(self, method: str, params):
+        self.send(method, params)
+        return self.receive()
+
+    def handle(self, msgs: list) -> None:
+        """
+        Submit a batch of messages in one round trip.
+        """
+        self.call("handle", msgs)
+
+    def events(self):
+        """
+        Yield the events pushed by the server after a watch request.
+        """
+        while True:
+            yield self.read()["event"]
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
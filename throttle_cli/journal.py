@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Optional, TextIO
+
+from xdg import BaseDirectory
+
+
+class Journal:
+    """
+    Append-only log of the messages the server accepted and hasn't finished
+    with yet, so the work can be picked up again after a restart.
+
+    Every line is a JSON record: accept (a new message, with its jobs),
+    advance (its chain moved on to the job at index), fail (an attempt of its
+    current job failed) and end (nothing of it is left to run). The messages
+    still alive are kept in memory too, and the file is rewritten with only
+    them once it grew enough.
+
+    Records are written as they come, but only synced to disk by flush, which
+    the message worker calls every fsync interval.
+    """
+
+    # rewrite the file once it has this many records more than live messages
+    COMPACT_AFTER = 1000
+
+    def __init__(self, path: Optional[Path] = None):
+        if path is None:
+            path = Path(BaseDirectory.xdg_state_home) / "throttle" / "journal.jsonl"
+        self.path = path
+        self.live: Dict[int, Dict[str, Any]] = {}
+        self.counter = 0
+        self.records = 0
+        self.f: Optional[TextIO] = None
+        self.logger = logging.getLogger("journal")
+
+    def open(self) -> TextIO:
+        # opened on first use, in the process that uses it
+        if self.f is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.f = open(self.path, "a")
+        return self.f
+
+    def write(self, record: Dict[str, Any]) -> None:
+        try:
+            self.open().write(json.dumps(record, separators=(",", ":")) + "\n")
+            self.records += 1
+        except OSError as e:
+            self.logger.error(f"failed writing to {self.path}: {e}")
+
+    def accept(self, msg: Dict[str, Any]) -> int:
+        """
+        Record a new message, returns the id to refer to it by.
+        """
+        self.counter += 1
+        self.live[self.counter] = {**msg, "failures": 0}
+        self.write({"op": "accept", "id": self.counter, "msg": msg})
+        return self.counter
+
+    def advance(self, id: int, index: int) -> None:
+        # a resumed message is handed on at the index it is at, with the
+        # failures it had
+        if id in self.live and self.live[id]["index"] != index:
+            self.live[id].update(index=index, failures=0)
+            self.write({"op": "advance", "id": id, "index": index})
+
+    def fail(self, id: int) -> None:
+        if id in self.live:
+            self.live[id]["failures"] += 1
+            self.write({"op": "fail", "id": id})
+
+    def end(self, id: int) -> None:
+        if self.live.pop(id, None) is not None:
+            self.write({"op": "end", "id": id})
+
+    def replay(self) -> Dict[int, Dict[str, Any]]:
+        """
+        The messages left alive in the file by their id, with the failures of
+        their current job. They are kept alive, and the file is compacted to
+        only them before anything else is written to it.
+        """
+        live: Dict[int, Dict[str, Any]] = {}
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last line can be cut short by a crash
+                        self.logger.warning(f"skipping broken record {line!r}")
+                        continue
+                    id = record["id"]
+                    match record["op"]:
+                        case "accept":
+                            live[id] = {**record["msg"], "failures": 0}
+                        case "advance" if id in live:
+                            live[id].update(index=record["index"], failures=0)
+                        case "fail" if id in live:
+                            live[id]["failures"] += 1
+                        case "end":
+                            live.pop(id, None)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.error(f"failed reading {self.path}: {e}")
+        self.live = live
+        self.counter = max(live, default=0)
+        self.compact()
+        return {id: dict(msg) for id, msg in live.items()}
+
+    def flush(self) -> None:
+        """
+        Sync the records written so far to disk, compacting the file if it
+        grew enough.
+        """
+        if self.f is None:
+            return
+        try:
+            self.f.flush()
+            os.fsync(self.f.fileno())
+        except OSError as e:
+            self.logger.error(f"failed syncing {self.path}: {e}")
+        if self.records > len(self.live) + self.COMPACT_AFTER:
+            self.compact()
+
+    def compact(self) -> None:
+        """
+        Replace the file with one accepting only the live messages.
+        """
+        lines = []
+        for id, msg in self.live.items():
+            msg = dict(msg)
+            failures = msg.pop("failures")
+            lines.append({"op": "accept", "id": id, "msg": msg})
+            lines += [{"op": "fail", "id": id}] * failures
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(
+                dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    for line in lines:
+                        f.write(json.dumps(line, separators=(",", ":")) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            # the rename itself has to be on disk too
+            dirfd = os.open(self.path.parent, os.O_RDONLY)
+            try:
+                os.fsync(dirfd)
+            finally:
+                os.close(dirfd)
+        except OSError as e:
+            self.logger.error(f"failed compacting {self.path}: {e}")
+            return
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        self.records = len(lines)
+
+    def close(self) -> None:
+        self.flush()
+        if self.f is not None:
+            self.f.close()
+            self.f = None
@@ -0,0 +1,148 @@
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .history import BOUNDS
+
+COUNTERS = (
+    ("triggers", "total", "Times the job was triggered."),
+    ("runs", "run", "Times the job was run."),
+    ("debounced", "debounced", "Triggers folded into another one by debounce."),
+    ("deferred", "deferred", "Runs postponed by the rate limit."),
+    ("held", "held", "Runs held back by the pressure of the system."),
+    ("skipped", "skipped", "Runs skipped as the inputs of the job didn't change."),
+    ("busy", "busy", "Scheduled triggers skipped as the job was still going."),
+    ("successes", "success", "Runs that succeeded."),
+    ("failures", "failure", "Attempts of a run that failed."),
+    ("retries", "retries", "Attempts of a run after the first one."),
+)
+HISTOGRAMS = (
+    ("run_duration_seconds", "duration", "Duration of an attempt of a run."),
+    (
+        "trigger_wait_seconds",
+        "wait",
+        "Time from a trigger to the start of its run.",
+    ),
+    (
+        "trigger_latency_seconds",
+        "latency",
+        "Time from a trigger to the end of its run.",
+    ),
+    (
+        "pressure_hold_seconds",
+        "pressure",
+        "Time a run was held back by the pressure of the system.",
+    ),
+)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(snapshot: Dict[str, Any], openmetrics: bool = False) -> str:
+    """
+    Render a snapshot of the server in the Prometheus text format, or in the
+    OpenMetrics one.
+    """
+    lines: List[str] = []
+
+    def family(name: str, kind: str, help: str) -> None:
+        if kind == "counter" and not openmetrics:
+            name += "_total"
+        lines.append(f"# HELP throttle_{name} {help}")
+        lines.append(f"# TYPE throttle_{name} {kind}")
+
+    jobs = snapshot["jobs"]
+    labels = {job: f'job="{escape(job)}"' for job in jobs}
+    for name, key, help in COUNTERS:
+        family(name, "counter", help)
+        for job, stats in jobs.items():
+            lines.append(f"throttle_{name}_total{{{labels[job]}}} {stats[key]}")
+    family("throttled", "counter", "Triggers that didn't run as one was queued.")
+    for job, stats in jobs.items():
+        throttled = max(stats["total"] - stats["run"] - stats["debounced"], 0)
+        lines.append(f"throttle_throttled_total{{{labels[job]}}} {throttled}")
+    for name, key, help in HISTOGRAMS:
+        family(name, "histogram", help)
+        for job, stats in jobs.items():
+            hist = stats[key]
+            cumulative = 0
+            for bound, count in zip(BOUNDS + (float("inf"),), hist["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{float(bound)}"
+                lines.append(
+                    f'throttle_{name}_bucket{{{labels[job]},le="{le}"}} {cumulative}'
+                )
+            lines.append(f"throttle_{name}_count{{{labels[job]}}} {cumulative}")
+            lines.append(f"throttle_{name}_sum{{{labels[job]}}} {hist['sum']}")
+    for name, help in (
+        ("workers", "Workers alive."),
+        ("running", "Jobs holding a slot."),
+        ("waiting", "Jobs waiting for a slot."),
+    ):
+        family(name, "gauge", help)
+        lines.append(f"throttle_{name} {snapshot[name]}")
+    family("queue_depth", "gauge", "Messages queued for the worker of a job.")
+    for job, depth in snapshot["queues"].items():
+        lines.append(f'throttle_queue_depth{{job="{escape(job)}"}} {depth}')
+    family("notifications", "counter", "Failure notifications by what became of them.")
+    for result, count in snapshot.get("notifications", {}).items():
+        lines.append(f'throttle_notifications_total{{result="{result}"}} {count}')
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+class TextfileWriter:
+    """
+    Writes snapshots to a file from a thread of its own, so rendering doesn't
+    hold up the message worker. Only the latest snapshot is written if they
+    come faster than they can be written. The file is replaced atomically, as
+    node_exporter's textfile collector expects.
+    """
+
+    def __init__(self, path: Path, openmetrics: bool = False):
+        self.path = path
+        self.openmetrics = openmetrics
+        self.snapshot: Optional[Dict[str, Any]] = None
+        self.ready = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.logger = logging.getLogger("metrics")
+
+    def submit(self, snapshot: Dict[str, Any]) -> None:
+        if self.thread is None:
+            # started on first use, in the process that uses it
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        with self.ready:
+            self.snapshot = snapshot
+            self.ready.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.ready:
+                while self.snapshot is None:
+                    self.ready.wait()
+                snapshot, self.snapshot = self.snapshot, None
+            try:
+                self.write(render(snapshot, self.openmetrics))
+            except Exception as e:
+                self.logger.error(f"failed writing metrics to {self.path}: {e!r}")
+
+    def write(self, text: str) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(
+            dir=self.path.parent, prefix=f".{self.path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
@@ -0,0 +1,142 @@
+import logging
+import os
+import shlex
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+class Notifier:
+    """
+    Runs notification_cmd from a thread of its own, so a slow or hung
+    notification doesn't hold up the workers.
+
+    Notifications with the same job, errcode and msg as one sent less than
+    window seconds ago are suppressed. With an interval, notifications are
+    collected for that many seconds and sent as a single digest. At most
+    maxsize notifications wait to be sent, further ones are dropped.
+    """
+
+    # a hung notification command is given up after this many seconds
+    TIMEOUT = 30
+
+    def __init__(
+        self,
+        cmd: Optional[str] = None,
+        maxsize: int = 100,
+        window: float = 60,
+        interval: float = 0,
+    ):
+        self.cmd = cmd
+        self.maxsize = maxsize
+        self.window = window
+        self.interval = interval
+        self.queue: Deque[Dict[str, Any]] = deque()
+        self.ready = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.counters = {"sent": 0, "suppressed": 0, "dropped": 0}
+        self.recent: Dict[Tuple[str, int, str], float] = {}
+        self.digest: List[Dict[str, Any]] = []
+        self.deadline: Optional[float] = None
+        self.logger = logging.getLogger("notifier")
+
+    def submit(self, notification: Dict[str, Any]) -> None:
+        if self.cmd is None:
+            return
+        if self.thread is None:
+            # started on first use, in the process that uses it
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        with self.ready:
+            if len(self.queue) >= self.maxsize:
+                self.counters["dropped"] += 1
+                self.logger.warning(
+                    f"notification queue is full, dropping {notification}"
+                )
+                return
+            self.queue.append(notification)
+            self.ready.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.ready:
+                while not self.queue:
+                    timeout = None
+                    if self.deadline is not None:
+                        timeout = self.deadline - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self.ready.wait(timeout)
+                notifications = list(self.queue)
+                self.queue.clear()
+            for notification in notifications:
+                if self.duplicate(notification):
+                    self.counters["suppressed"] += 1
+                elif self.interval:
+                    if self.deadline is None:
+                        self.deadline = time.monotonic() + self.interval
+                    self.digest.append(notification)
+                else:
+                    self.send(**notification)
+            if self.deadline is not None and self.deadline <= time.monotonic():
+                self.sendDigest()
+
+    def duplicate(self, notification: Dict[str, Any]) -> bool:
+        """
+        Whether the same notification was sent within the window, remembers
+        it otherwise.
+        """
+        now = time.monotonic()
+        self.recent = {
+            key: t for key, t in self.recent.items() if now - t < self.window
+        }
+        key = (notification["job"], notification["errcode"], notification["msg"])
+        if key in self.recent:
+            return True
+        self.recent[key] = now
+        return False
+
+    def sendDigest(self) -> None:
+        digest, self.digest, self.deadline = self.digest, [], None
+        if len(digest) == 1:
+            self.send(**digest[0])
+            return
+        jobs = {notification["job"] for notification in digest}
+        errcodes = {notification["errcode"] for notification in digest}
+        self.send(
+            job=f"{len(jobs)} jobs failed {len(digest)} times",
+            origin=", ".join(sorted({n["origin"] for n in digest if n["origin"]})),
+            errcode=errcodes.pop() if len(errcodes) == 1 else -1000,
+            msg="\n".join(
+                f"{n['job']} ({n['errcode']}): {n['msg'].strip()[:200]}" for n in digest
+            ),
+        )
+
+    def send(
+        self,
+        job: str = "",
+        origin: str = "",
+        urgency: str = "critical",
+        errcode: int = -1000,
+        msg: str = "",
+    ) -> None:
+        try:
+            self.logger.debug(f"sending message {job=}, {msg=}, {urgency=}, {errcode=}")
+            subprocess.run(
+                shlex.split(
+                    self.cmd.format(
+                        job=job,
+                        origin=origin,
+                        urgency=urgency,
+                        msg=msg,
+                        errcode=errcode,
+                    )
+                ),
+                env=os.environ.copy(),
+                timeout=self.TIMEOUT,
+            )
+            self.counters["sent"] += 1
+        except Exception as e:
+            self.logger.error(f"failed sending notification command with error: {e}")
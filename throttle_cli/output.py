@@ -0,0 +1,144 @@
+import os
+import re
+import selectors
+import signal
+import subprocess
+import time
+from hashlib import sha1
+from pathlib import Path
+from typing import Optional
+
+from xdg import BaseDirectory
+
+CHUNK = 64 * 1024
+
+
+class RingBuffer:
+    """
+    Keeps the last size bytes written to it.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.buf = bytearray()
+        self.dropped = 0
+
+    def write(self, data: bytes) -> None:
+        self.buf += data
+        excess = len(self.buf) - self.size
+        if excess > 0:
+            # deleting from the front of a bytearray doesn't copy the rest
+            del self.buf[:excess]
+            self.dropped += excess
+
+    def tail(self) -> bytes:
+        if self.dropped:
+            return b"[%d bytes dropped] ..." % self.dropped + bytes(self.buf)
+        return bytes(self.buf)
+
+
+class RotatingFile:
+    """
+    Appends to path, moving it to path.1, path.2, ... once it would grow over
+    maxbytes, keeping at most backups old files.
+    """
+
+    def __init__(self, path: Path, maxbytes: int, backups: int):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.backups = backups
+        self.f = open(path, "ab")
+        self.size = self.f.tell()
+
+    def write(self, data: bytes) -> None:
+        if self.size and self.size + len(data) > self.maxbytes:
+            self.rotate()
+        self.f.write(data)
+        self.size += len(data)
+
+    def rotate(self) -> None:
+        self.f.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = self.path.with_name(f"{self.path.name}.{i}")
+            if src.exists():
+                src.replace(self.path.with_name(f"{self.path.name}.{i + 1}"))
+        if self.backups:
+            self.path.replace(self.path.with_name(f"{self.path.name}.1"))
+        self.f = open(self.path, "wb")
+        self.size = 0
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def output_path(job: str) -> Path:
+    """
+    Output file of a job under $XDG_STATE_HOME/throttle/output.
+    """
+    folder = Path(BaseDirectory.xdg_state_home) / "throttle" / "output"
+    folder.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r"[^\w.-]+", "_", job)[:64]
+    return folder / f"{name}-{sha1(job.encode()).hexdigest()[:8]}.log"
+
+
+class Capture:
+    """
+    Output of a run: the tail of each stream is kept in memory, everything is
+    optionally appended to a rotating file as it comes.
+    """
+
+    def __init__(self, tail: int, logfile: Optional[RotatingFile] = None):
+        self.stdout = RingBuffer(tail)
+        self.stderr = RingBuffer(tail)
+        self.logfile = logfile
+
+    def write(self, stream: RingBuffer, data: bytes) -> None:
+        stream.write(data)
+        if self.logfile is not None:
+            self.logfile.write(data)
+
+    def start(self, job: str) -> None:
+        if self.logfile is not None:
+            self.logfile.write(f"--- {time.ctime()}: {job}\n".encode())
+
+    def close(self) -> None:
+        if self.logfile is not None:
+            self.logfile.close()
+
+
+def communicate(proc: subprocess.Popen, capture: Capture, timeout: float) -> None:
+    """
+    Stream the output of proc into capture until it exits, killing its
+    process group after timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as sel:
+        sel.register(proc.stdout, selectors.EVENT_READ, capture.stdout)
+        sel.register(proc.stderr, selectors.EVENT_READ, capture.stderr)
+        while sel.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                kill(proc)
+                raise subprocess.TimeoutExpired(proc.args, timeout)
+            for key, _ in sel.select(remaining):
+                data = os.read(key.fd, CHUNK)
+                if data:
+                    capture.write(key.data, data)
+                else:
+                    sel.unregister(key.fileobj)
+    try:
+        proc.wait(timeout=max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        kill(proc)
+        raise
+
+
+def kill(proc: subprocess.Popen) -> None:
+    """
+    Kill a command started in its own session with all of its children.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
@@ -0,0 +1,144 @@
+import datetime
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+# ranges of the fields of a cron expression
+FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+class Cron:
+    """
+    A cron expression of the usual five fields (minute, hour, day of month,
+    month, day of week) made of *, numbers, ranges, lists and steps, in local
+    time. As in cron, if both days are restricted either one has to match.
+    """
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"{expression!r} doesn't have five fields")
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            sorted(parseField(f, low, high)) for f, (low, high) in zip(fields, FIELDS)
+        )
+        # sunday is both 0 and 7
+        self.weekdays = sorted({d % 7 for d in self.weekdays})
+        # as in cron, */2 counts as unrestricted too
+        self.anyday = fields[2].startswith("*")
+        self.anyweekday = fields[4].startswith("*")
+        # raises if it never fires, e.g. on the 30th of February
+        self.next(datetime.datetime.now())
+
+    def matches(self, day: datetime.date) -> bool:
+        if day.month not in self.months:
+            return False
+        dom = day.day in self.days
+        dow = (day.weekday() + 1) % 7 in self.weekdays
+        if self.anyday or self.anyweekday:
+            return dom and dow
+        return dom or dow
+
+    def next(self, after: datetime.datetime) -> datetime.datetime:
+        """
+        The first time after the given one the expression fires.
+        """
+        start = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        first = start.hour * 60 + start.minute
+        # leap days can be up to 8 years apart
+        for i in range(8 * 366 + 1):
+            day = start.date() + datetime.timedelta(days=i)
+            if not self.matches(day):
+                continue
+            for hour in self.hours:
+                for minute in self.minutes:
+                    if i == 0 and hour * 60 + minute < first:
+                        continue
+                    return datetime.datetime.combine(day, datetime.time(hour, minute))
+        raise ValueError("the cron expression never fires")
+
+
+def parseField(value: str, low: int, high: int) -> Set[int]:
+    """
+    The values a field of a cron expression stands for.
+    """
+    values: Set[int] = set()
+    for part in value.split(","):
+        part, _, step = part.partition("/")
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start, end = (int(v) for v in part.split("-", 1))
+        else:
+            start = end = int(part)
+            if step:
+                end = high
+        every = int(step) if step else 1
+        if not low <= start <= end <= high or every < 1:
+            raise ValueError(f"{value!r} is out of range {low}-{high}")
+        values.update(range(start, end + 1, every))
+    return values
+
+
+def checkSchedule(section: Dict[str, Any]) -> None:
+    """
+    Raise ValueError if a [[schedule]] config section can't be used.
+    """
+    jobs = section.get("jobs")
+    if not isinstance(jobs, list) or not jobs:
+        raise ValueError(f"{section} in schedule needs a non-empty list of jobs")
+    if not all(isinstance(job, str) for job in jobs):
+        raise ValueError(f"{section} in schedule has jobs that aren't strings")
+    if ("interval" in section) == ("cron" in section):
+        raise ValueError(f"{section} in schedule needs either interval or cron")
+    for key in ("interval", "jitter"):
+        value = section.get(key, 0)
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"{section} in schedule has an invalid {key}")
+    if "interval" in section and section["interval"] <= 0:
+        raise ValueError(f"{section} in schedule has an invalid interval")
+    if "cron" in section:
+        if not isinstance(section["cron"], str):
+            raise ValueError(f"{section} in schedule has an invalid cron")
+        Cron(section["cron"])
+
+
+@dataclass
+class Schedule:
+    """
+    When to trigger the jobs of a [[schedule]] config section: every interval
+    seconds or whenever the cron expression fires, plus a random delay of up
+    to jitter seconds.
+    """
+
+    section: Dict[str, Any]
+    jobs: List[str] = field(init=False)
+    notifications: List[int] = field(init=False)
+    origin: str = field(init=False)
+    cron: Optional[Cron] = field(init=False)
+    # when the cron expression fires next
+    due: Optional[datetime.datetime] = None
+    # cleared when a reload replaces it, its timer is left to run out
+    active: bool = True
+
+    def __post_init__(self) -> None:
+        self.jobs = list(self.section["jobs"])
+        notification = 0 if self.section.get("silent", False) else 1
+        self.notifications = [notification] * len(self.jobs)
+        self.origin = self.section.get("origin", "schedule")
+        self.cron = Cron(self.section["cron"]) if "cron" in self.section else None
+
+    def delay(self) -> float:
+        """
+        Seconds until it fires next.
+        """
+        jitter = random.uniform(0, self.section.get("jitter", 0))
+        if self.cron is None:
+            return self.section["interval"] + jitter
+        now = datetime.datetime.now()
+        # a timer running a bit early mustn't fire twice
+        if self.due is not None and self.due > now:
+            now = self.due
+        self.due = self.cron.next(now)
+        # through the timestamp, which knows about daylight saving time
+        return self.due.timestamp() - time.time() + jitter
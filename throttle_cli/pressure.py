@@ -0,0 +1,64 @@
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional, Set
+
+
+class Pressure:
+    """
+    Checks the pressure stall information (the share of the last 10 seconds
+    some tasks were stalled on the cpu, memory or io, in percent) and the 1
+    minute load average per cpu of the machine against thresholds.
+
+    A threshold of 0 isn't checked, and what can't be read (e.g. on a kernel
+    without PSI) doesn't count as pressure.
+    """
+
+    def __init__(
+        self,
+        cpu: float = 0,
+        memory: float = 0,
+        io: float = 0,
+        loadavg: float = 0,
+        root: Path = Path("/proc"),
+    ):
+        self.thresholds = {"cpu": cpu, "memory": memory, "io": io, "loadavg": loadavg}
+        self.root = root
+        self.logger = logging.getLogger("pressure")
+        self.unreadable: Set[str] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.thresholds.values())
+
+    def read(self, resource: str) -> Optional[float]:
+        try:
+            if resource == "loadavg":
+                load = float((self.root / "loadavg").read_text().split()[0])
+                return load / (os.cpu_count() or 1)
+            with open(self.root / "pressure" / resource) as f:
+                for line in f:
+                    kind, *fields = line.split()
+                    if kind == "some":
+                        return float(
+                            dict(field.split("=") for field in fields)["avg10"]
+                        )
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            if resource not in self.unreadable:
+                # only logged once, it isn't going to change
+                self.unreadable.add(resource)
+                self.logger.warning(f"can't read the pressure of {resource}: {e}")
+        return None
+
+    def high(self) -> Dict[str, float]:
+        """
+        The readings that are over their threshold, empty if there are none.
+        """
+        readings = {}
+        for resource, threshold in self.thresholds.items():
+            if not threshold:
+                continue
+            value = self.read(resource)
+            if value is not None and value > threshold:
+                readings[resource] = value
+        return readings
@@ -0,0 +1,34 @@
+import time
+
+
+class TokenBucket:
+    """
+    Allows rate runs per second on average and up to burst runs at once.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.t = time.monotonic()
+
+    @classmethod
+    def from_options(cls, options) -> "TokenBucket | None":
+        if options.get("min_interval"):
+            return cls(1 / options["min_interval"])
+        if options.get("rate"):
+            return cls(options["rate"], options.get("burst", 1))
+        return None
+
+    def take(self) -> float:
+        """
+        Take a token if there is one, otherwise returns the seconds until there
+        will be one.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.t) * self.rate)
+        self.t = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
@@ -0,0 +1,160 @@
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .structures import Msg
+
+
+@dataclass
+class waitingitem:
+    msgs: List[Msg]
+    # of the highest priority class among the messages
+    priority: float = 0
+    name: str = "default"
+    t: float = field(default_factory=time.time)
+
+    def promote(self, priority: float, name: str) -> None:
+        if priority > self.priority:
+            self.priority = priority
+            self.name = name
+
+
+@dataclass
+class limititem:
+    pattern: re.Pattern
+    max_concurrent: int
+    running: int = 0
+
+
+class Scheduler:
+    """
+    Admission of jobs under a global and per-pattern concurrency limits.
+
+    A job holds a slot from the moment a run is handed to its worker until all
+    runs handed to it are done, except while it waits to retry a failed
+    attempt: then it gives the slot up and waits for one again before the
+    next attempt. Jobs that don't fit wait, and whenever a slot
+    is freed they are admitted by the priority of their class, first come,
+    first served among equals. Every aging seconds a job waits count as one
+    more priority, so that a low priority job isn't starved forever.
+    """
+
+    # seconds of waiting worth one priority, 0 to not age
+    aging: float = 60
+
+    def __init__(
+        self,
+        max_concurrent: int = 0,
+        limits: Optional[List[Tuple[str, int]]] = None,
+    ):
+        self.running: Dict[str, int] = {}
+        self.waiting: Dict[str, waitingitem] = {}
+        # runs of the jobs that gave their slot up to wait for a retry
+        self.retrying: Dict[str, int] = {}
+        self.configure(max_concurrent, limits)
+
+    def configure(
+        self,
+        max_concurrent: int = 0,
+        limits: Optional[List[Tuple[str, int]]] = None,
+    ) -> None:
+        """
+        Set the limits, counting the jobs already holding a slot against the
+        new ones.
+        """
+        self.max_concurrent = max_concurrent
+        self.limits = [limititem(re.compile(p), n) for p, n in limits or []]
+        self._matching: Dict[str, List[limititem]] = {}
+        for job in self.running:
+            for limit in self.matching(job):
+                limit.running += 1
+
+    def matching(self, job: str) -> List[limititem]:
+        if job not in self._matching:
+            self._matching[job] = [
+                limit for limit in self.limits if limit.pattern.search(job)
+            ]
+        return self._matching[job]
+
+    def holds(self, job: str) -> bool:
+        return job in self.running
+
+    def active(self, job: str) -> bool:
+        """
+        Whether the job has a run going, with or without a slot.
+        """
+        return job in self.running or job in self.retrying
+
+    def fits(self, job: str) -> bool:
+        if self.max_concurrent and len(self.running) >= self.max_concurrent:
+            return False
+        return all(limit.running < limit.max_concurrent for limit in self.matching(job))
+
+    def wait(
+        self, job: str, msg: Msg, priority: float = 0, name: str = "default"
+    ) -> None:
+        self.waiting[job] = waitingitem([msg], priority, name)
+
+    def rank(self, item: waitingitem, now: float) -> float:
+        if not self.aging:
+            return item.priority
+        return item.priority + (now - item.t) / self.aging
+
+    def admit(self) -> Iterator[Tuple[str, List[Msg]]]:
+        """
+        Yield waiting jobs that fit in the free slots, highest ranking first.
+        """
+        now = time.time()
+        # sorting is stable, so equals stay in arrival order
+        for job in sorted(
+            self.waiting, key=lambda job: -self.rank(self.waiting[job], now)
+        ):
+            if not self.fits(job):
+                continue
+            self.running[job] = 0
+            for limit in self.matching(job):
+                limit.running += 1
+            yield job, self.waiting.pop(job).msgs
+
+    def acquire(self, job: str) -> None:
+        """
+        Count a run handed to the worker of an admitted job.
+        """
+        self.running[job] += 1
+
+    def release(self, job: str) -> None:
+        """
+        Count a finished run, the slot is freed once no runs are left.
+        """
+        if job not in self.running:
+            return
+        self.running[job] -= 1
+        if self.running[job] <= 0:
+            self.drop(job)
+
+    def backoff(self, job: str) -> None:
+        """
+        Free the slot of a job waiting to retry a failed attempt, its runs are
+        counted again once it is admitted again.
+        """
+        if job in self.running:
+            self.retrying[job] = self.running[job]
+            self.free(job)
+
+    def resume(self, job: str) -> None:
+        """
+        Count the runs of an admitted job that was waiting to retry.
+        """
+        self.running[job] += self.retrying.pop(job, 0)
+
+    def drop(self, job: str) -> None:
+        self.waiting.pop(job, None)
+        self.retrying.pop(job, None)
+        self.free(job)
+
+    def free(self, job: str) -> None:
+        if self.running.pop(job, None) is None:
+            return
+        for limit in self.matching(job):
+            limit.running -= 1
@@ -1,57 +1,419 @@
+import asyncio
+import json
 import logging
 import os
+import signal
 import socket
+import threading
 import time
 from multiprocessing import Process, Queue, active_children
 from pathlib import Path
-from typing import Any, Callable
+from typing import Any, Callable, Dict, Optional, Set
 
-from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer
+from . import history, ipc, loglib
+from .asyncworker import AsyncCommandWorker
+from .commandworker import WORKERS, CommandWorker
+from .structures import ActionType, Msg
 
-from . import loglib
-from .commandworker import CommandWorker
-from .structures import Msg
 
+async def read_header(reader: asyncio.StreamReader) -> Optional[bytes]:
+    try:
+        return await reader.readexactly(ipc.HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise ipc.ProtocolError("truncated frame header")
+        return None
 
-def ipcworker(socketpath: Path, handleMsg: Callable, handleInfo: Callable) -> None:
+
+async def read_frame(
+    reader: asyncio.StreamReader, header: Optional[bytes] = None
+) -> Optional[Any]:
+    if header is None:
+        header = await read_header(reader)
+        if header is None:
+            return None
+    (length,) = ipc.HEADER.unpack(header)
+    if length > ipc.MAX_FRAME:
+        raise ipc.ProtocolError(f"frame of {length} bytes is too large")
+    return json.loads(await reader.readexactly(length))
+
+
+class IPCServer:
+    """
+    Serves handle and info requests on a unix socket, handle takes a message
+    or a list of them, info takes a single message.
+
+    Info requests are answered from the latest snapshot the message worker
+    published, which is replaced as a whole by a reader thread, so they never
+    wait on the message worker or on each other.
+
+    A watch request is answered with the current status, after which the
+    events of the message worker are pushed on the connection as
+    {"event": ...} frames until it is closed.
+
+    With jsonrpc, connections starting with an HTTP POST instead of a frame
+    header are served the JSON-RPC protocol of older clients.
+    """
+
+    # watchers that fall this far behind are dropped
+    MAX_BACKLOG = 1024 * 1024
+
+    def __init__(
+        self,
+        handleMsg: Callable,
+        snapshots: Queue,
+        datagram: Optional["DatagramServer"] = None,
+        events: Optional[Queue] = None,
+        jsonrpc: bool = False,
+    ):
+        self.handleMsg = handleMsg
+        self.snapshots = snapshots
+        self.snapshot: Dict[str, Any] = {
+            "version": 0,
+            "statistics": {"jobs": {}},
+            "status": {},
+            "pending": {},
+            "flushes": 0,
+            "flushed": 0,
+        }
+        self.history = history.History()
+        self.datagram = datagram
+        self.events = events
+        self.watchers: Set[asyncio.StreamWriter] = set()
+        # watchers waiting for their status, with the id of their request
+        self.waiting: Dict[asyncio.StreamWriter, Any] = {}
+        self.dispatcher = None
+        if jsonrpc:
+            from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCDispatcher
+
+            self.dispatcher = SimpleJSONRPCDispatcher()
+            self.dispatcher.register_function(handleMsg, "handle")
+            self.dispatcher.register_function(self.jsonrpcInfo, "info")
+        self.logger = logging.getLogger("ipc_worker")
+
+    async def call(self, method: str, params: Any) -> Any:
+        match method:
+            case "handle":
+                msgs = params if isinstance(params, list) else [params]
+                # a bad message turns away the whole request, not only the
+                # messages after it
+                for msg in msgs:
+                    Msg.from_dict(msg)
+                for msg in msgs:
+                    self.handleMsg(msg)
+                return None
+            case "info":
+                return await self.info(Msg.from_dict(params))
+        raise ipc.ProtocolError(f"unknown method {method}")
+
+    async def info(self, msg: Msg) -> Dict[str, Any]:
+        snapshot = self.snapshot
+        match msg.action:
+            case ActionType.STATUS:
+                return snapshot["status"]
+            case ActionType.STATS:
+                if msg.data.get("since"):
+                    loop = asyncio.get_running_loop()
+                    result = await loop.run_in_executor(
+                        None,
+                        self.history.query,
+                        time.time() - msg.data["since"],
+                        snapshot["pending"],
+                        snapshot["flushed"],
+                    )
+                else:
+                    result = dict(snapshot["statistics"])
+                result["version"] = snapshot["version"]
+                if self.datagram is not None:
+                    result["datagrams"] = dict(self.datagram.counters)
+                return result
+        raise ipc.ProtocolError(f"{msg.action.name} is not an info request")
+
+    def readSnapshots(self) -> None:
+        while True:
+            snapshot = self.snapshots.get()
+            # it only has the statistics that changed, the dicts of the
+            # previous snapshot are left alone for the readers still using it
+            previous = self.snapshot
+            statistics = snapshot["statistics"]
+            statistics["jobs"] = {
+                **previous["statistics"]["jobs"],
+                **statistics["jobs"],
+            }
+            if snapshot["flushes"] == previous["flushes"]:
+                snapshot["pending"] = {**previous["pending"], **snapshot["pending"]}
+            # replacing the reference is atomic, readers see either snapshot
+            self.snapshot = snapshot
+
+    async def watch(
+        self, request: Dict[str, Any], writer: asyncio.StreamWriter
+    ) -> None:
+        if self.events is None:
+            raise ipc.ProtocolError("the server doesn't publish events")
+        # the message worker sends the status along with its events, so that
+        # none are missed in between
+        self.waiting[writer] = request.get("id")
+        self.watching(status=True)
+
+    def watching(self, status: bool = False) -> None:
+        """
+        Let the message worker know whether anybody is watching, and whether
+        to send the status for a new watcher.
+        """
+        data = {"watchers": len(self.watchers) + len(self.waiting), "status": status}
+        self.handleMsg({"action": "WATCH", "data": data})
+
+    def unwatch(self, writer: asyncio.StreamWriter) -> None:
+        if writer in self.watchers or writer in self.waiting:
+            self.watchers.discard(writer)
+            self.waiting.pop(writer, None)
+            self.watching()
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        if "status" in event:
+            for writer, id in self.waiting.items():
+                writer.write(ipc.encode({"id": id, "result": event["status"]}))
+            self.watchers.update(self.waiting)
+            self.waiting.clear()
+            return
+        frame = ipc.encode({"event": event})
+        for writer in list(self.watchers):
+            if writer.transport.get_write_buffer_size() > self.MAX_BACKLOG:
+                self.logger.warning("dropping a watcher that can't keep up")
+                self.unwatch(writer)
+                writer.close()
+            else:
+                writer.write(frame)
+
+    def readEvents(self, loop: asyncio.AbstractEventLoop) -> None:
+        while True:
+            event = self.events.get()
+            loop.call_soon_threadsafe(self.publish, event)
+
+    def jsonrpcInfo(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        # called by the dispatcher in a thread of the executor
+        return asyncio.run_coroutine_threadsafe(
+            self.info(Msg.from_dict(msg)), self.loop
+        ).result()
+
+    async def serveJSONRPC(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Answer JSON-RPC requests over HTTP until the client closes the
+        connection, the first 4 bytes of the request line were read already.
+        """
+        header = b"POST"
+        while header is not None:
+            if header != b"POST":
+                raise ipc.ProtocolError("only POST requests are served")
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            close = False
+            for line in head.decode("latin-1").split("\r\n")[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value)
+                elif name.strip().lower() == "connection":
+                    close = value.strip().lower() == "close"
+            if length > ipc.MAX_FRAME:
+                raise ipc.ProtocolError(f"request of {length} bytes is too large")
+            body = (await reader.readexactly(length)).decode("utf-8")
+            # the registered functions are blocking
+            response = await self.loop.run_in_executor(
+                None, self.dispatcher._marshaled_dispatch, body
+            )
+            data = (response or "").encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json-rpc\r\n"
+                + f"Content-Length: {len(data)}\r\n\r\n".encode()
+                + data
+            )
+            await writer.drain()
+            if close:
+                return
+            header = await read_header(reader)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            header = await read_header(reader)
+            if header == b"POST" and self.dispatcher is not None:
+                await self.serveJSONRPC(reader, writer)
+                return
+            while header is not None:
+                request = await read_frame(reader, header)
+                if not isinstance(request, dict):
+                    raise ipc.ProtocolError(f"{request!r} is not a request")
+                response: Dict[str, Any] = {"id": request.get("id")}
+                try:
+                    if request.get("method") == "watch":
+                        await self.watch(request, writer)
+                        response["id"] = None
+                    else:
+                        response["result"] = await self.call(
+                            request.get("method"), request.get("params")
+                        )
+                except Exception as e:
+                    self.logger.error(f"request {request} failed with {e!r}")
+                    response["error"] = repr(e)
+                if response["id"] is not None:
+                    writer.write(ipc.encode(response))
+                    await writer.drain()
+                header = await read_header(reader)
+        except (
+            ipc.ProtocolError,
+            ValueError,
+            ConnectionError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+        ) as e:
+            self.logger.error(f"dropping connection: {e!r}")
+        finally:
+            self.unwatch(writer)
+            writer.close()
+
+    async def serve(self, socketpath: Path) -> None:
+        srv = await asyncio.start_unix_server(
+            self.handle_connection, path=str(socketpath)
+        )
+        self.logger.info(f"starting up server on socket: {socketpath}")
+        self.loop = asyncio.get_running_loop()
+        threading.Thread(target=self.readSnapshots, daemon=True).start()
+        if self.events is not None:
+            threading.Thread(
+                target=self.readEvents,
+                args=(self.loop,),
+                daemon=True,
+            ).start()
+        if self.datagram is not None:
+            await self.datagram.serve()
+        async with srv:
+            await srv.serve_forever()
+
+
+class DatagramServer(asyncio.DatagramProtocol):
+    """
+    Takes one-shot RUN and KILL messages on a datagram socket, one JSON
+    message or list of messages per datagram, without replying.
+
+    Datagrams are best effort: while more than backlog messages are waiting
+    for the msgworker, they are dropped and counted. A full socket buffer
+    makes the sender's nonblocking send fail instead, so clients can fall
+    back to the stream socket.
+    """
+
+    ACTIONS = ("RUN", "KILL")
+
+    def __init__(
+        self,
+        socketpath: Path,
+        handleMsg: Callable,
+        pending: Callable[[], int],
+        backlog: int,
+    ):
+        self.socketpath = socketpath
+        self.handleMsg = handleMsg
+        self.pending = pending
+        self.backlog = backlog
+        self.counters = {"received": 0, "dropped": 0}
+        self.logger = logging.getLogger("ipc_worker")
+
+    async def serve(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(str(self.socketpath))
+        loop = asyncio.get_running_loop()
+        await loop.create_datagram_endpoint(lambda: self, sock=sock)
+        self.logger.info(f"accepting datagrams on socket: {self.socketpath}")
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        self.counters["received"] += 1
+        try:
+            msgs = json.loads(data)
+            if not isinstance(msgs, list):
+                msgs = [msgs]
+            if any(msg.get("action") not in self.ACTIONS for msg in msgs):
+                raise ipc.ProtocolError("only RUN and KILL can be sent as datagrams")
+            # a bad message drops the whole datagram, not only the messages
+            # after it
+            for msg in msgs:
+                Msg.from_dict(msg)
+        except (ValueError, TypeError, AttributeError, ipc.ProtocolError) as e:
+            self.counters["dropped"] += 1
+            self.logger.error(f"dropping datagram: {e!r}")
+            return
+        if self.pending() >= self.backlog:
+            self.counters["dropped"] += 1
+            self.logger.warning(f"backlog of {self.backlog} is full, dropping {msgs}")
+            return
+        for msg in msgs:
+            self.handleMsg(msg)
+
+
+def prepare_socket(socketpath: Path) -> None:
     socketpath.parent.mkdir(parents=True, exist_ok=True)
     if Path(socketpath).exists():
         Path(socketpath).unlink()
-    logger = logging.getLogger("ipc_worker")
-    srv = SimpleJSONRPCServer(str(socketpath), address_family=socket.AF_UNIX)
-    srv.register_function(handleMsg, "handle")
-    srv.register_function(handleInfo, "info")
-    logger.info(f"starting up server on socket: {socketpath}")
-    srv.serve_forever()
 
 
-def start_server(socketpath: Path, loglevel) -> None:
-    ipcqueue: Queue[Msg] = Queue()
-    logqueue: Queue[Any] = Queue()
+def ipcworker(
+    socketpath: Path,
+    handleMsg: Callable,
+    snapshots: Queue,
+    datagram: Optional[DatagramServer] = None,
+    events: Optional[Queue] = None,
+    jsonrpc: bool = False,
+) -> None:
+    prepare_socket(socketpath)
+    if datagram is not None:
+        prepare_socket(datagram.socketpath)
+    srv = IPCServer(handleMsg, snapshots, datagram, events, jsonrpc)
+    asyncio.run(srv.serve(socketpath))
+
+
+ENGINES = {"process": CommandWorker, "asyncio": AsyncCommandWorker}
+
+
+def start_server(
+    socketpath: Path,
+    loglevel,
+    engine: str = "process",
+    jsonrpc: bool = False,
+    datagrampath: Optional[Path] = None,
+    datagram_backlog: int = 10000,
+) -> None:
+    # handed on to the job workers
+    ipcqueue: Queue[Msg] = WORKERS.Queue()
+    logqueue: Queue[Any] = WORKERS.Queue()
     comqueue: Queue[Any] = Queue()
+    eventqueue: Queue[Any] = Queue()
     loggerp = Process(target=loglib.consumer, args=(logqueue,))
     loggerp.start()
 
-    msgworker = CommandWorker(ipcqueue, logqueue, comqueue)
+    msgworker = ENGINES[engine](ipcqueue, logqueue, comqueue, eventqueue)
     loglib.publisher_config(logqueue, loglevel)
     logger = logging.getLogger("server")
+    logger.info(f"using {engine} engine")
     logger.debug(os.environ)
 
     def handleMsg(msg) -> None:
-        ipcqueue.put(Msg(**msg))
-
-    def handleInfo(msg):
-        print("handling")
-        ipcqueue.put(Msg(**msg))
-        return comqueue.get()
+        ipcqueue.put(Msg.from_dict(msg))
 
+    datagram = None
+    if datagrampath is not None:
+        datagram = DatagramServer(
+            datagrampath, handleMsg, ipcqueue.qsize, datagram_backlog
+        )
     p_ipc = Process(
         target=ipcworker,
-        args=(socketpath, handleMsg, handleInfo),
+        args=(socketpath, handleMsg, comqueue, datagram, eventqueue, jsonrpc),
     )
     p_msg = Process(target=msgworker.msgworker, args=())
     p_ipc.start()
     p_msg.start()
+    # set after starting the children, so they don't inherit it
+    signal.signal(signal.SIGHUP, lambda *_: ipcqueue.put(Msg(action=ActionType.RELOAD)))
     while True:
         time.sleep(1)
         if not active_children():
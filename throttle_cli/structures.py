@@ -1,15 +1,26 @@
+import time
 from dataclasses import dataclass, field
-from enum import Enum, auto
-from typing import List
+from enum import Enum
+from typing import Any, Dict, List
 
 
 class ActionType(Enum):
-    RUN = auto()  # run job
-    CONT = auto()  # don't run this job, but call next
-    KILL = auto()  # kill job
-    CLEAN = auto()  # clear up dangling jobs
-    STATS = auto()  # return stats to client
-    STATUS = auto()  # return current status to client
+    # the values go over the wire to JSON-RPC clients, keep them stable and
+    # add new ones at the end
+    RUN = 1  # run job
+    CONT = 2  # don't run this job, but call next
+    KILL = 3  # kill job
+    CLEAN = 4  # clear up dangling jobs
+    STATS = 5  # return stats to client, answered from a snapshot
+    STATUS = 6  # return current status to client, answered from a snapshot
+    DONE = 7  # a run of a job finished, free its slot
+    FAILED = 8  # an attempt of a run failed, it will be retried
+    STARTED = 9  # a worker started a run
+    WATCH = 10  # the number of clients watching events changed
+    NOTIFY = 11  # a worker asks for a notification to be sent
+    RELOAD = 12  # reload the config
+    END = 13  # nothing is left to run of a journaled message
+    RETRY = 14  # a worker is done waiting to retry and needs a slot again
 
 
 @dataclass
@@ -19,6 +30,47 @@ class Msg:
     notifications: List[int] = field(default_factory=list)
     index: int = 0
     origin: str = ""
+    # when the job was triggered
+    t: float = field(default_factory=time.time)
+    # what a worker reports with DONE, the options of STATS, or the failures
+    # of a RUN resumed from the journal
+    data: Dict[str, Any] = field(default_factory=dict)
+    # of the message in the journal, 0 if it isn't journaled
+    id: int = 0
+    # for a DAG submission, the indices of the jobs each job comes after
+    after: List[List[int]] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Msg":
+        """
+        Build a message sent by a client, which might name the action.
+        """
+        d = dict(d)
+        if isinstance(d.get("action"), str):
+            d["action"] = ActionType[d["action"]]
+        msg = cls(**d)
+        msg.validate()
+        return msg
+
+    def validate(self) -> None:
+        """
+        Raise ValueError if a message sent by a client can't be handled, so
+        that it is turned away before it reaches the message worker.
+        """
+        if self.action not in (ActionType.RUN, ActionType.CONT, ActionType.KILL):
+            return
+        if (
+            not isinstance(self.jobs, list)
+            or not self.jobs
+            or not all(isinstance(job, str) for job in self.jobs)
+        ):
+            raise ValueError(f"{self.action.name} needs a non-empty list of jobs")
+        if not isinstance(self.notifications, list) or len(self.notifications) != len(
+            self.jobs
+        ):
+            raise ValueError(f"{self.action.name} needs a notification for every job")
+        if not isinstance(self.index, int) or not 0 <= self.index < len(self.jobs):
+            raise ValueError(f"{self.action.name} has no job at index {self.index}")
 
     @property
     def job(self) -> str:
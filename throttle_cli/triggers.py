@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+from multiprocessing import Queue
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from . import inotify
+from .structures import ActionType, Msg
+
+EVENTS = {
+    "modify": inotify.IN_MODIFY,
+    "attrib": inotify.IN_ATTRIB,
+    "close_write": inotify.IN_CLOSE_WRITE,
+    "moved_from": inotify.IN_MOVED_FROM,
+    "moved_to": inotify.IN_MOVED_TO,
+    "create": inotify.IN_CREATE,
+    "delete": inotify.IN_DELETE,
+}
+DEFAULT_EVENTS = ["close_write", "moved_from", "moved_to", "create", "delete"]
+
+
+def checkWatch(section: Dict[str, Any]) -> None:
+    """
+    Raise ValueError if a [[watch]] config section can't be used.
+    """
+    for key in ("paths", "jobs"):
+        value = section.get(key)
+        if not isinstance(value, list) or not value:
+            raise ValueError(f"{section} in watch needs a non-empty list of {key}")
+        if not all(isinstance(v, str) for v in value):
+            raise ValueError(f"{section} in watch has {key} that aren't strings")
+    events = section.get("events", DEFAULT_EVENTS)
+    if not isinstance(events, list) or not all(e in EVENTS for e in events):
+        raise ValueError(f"{section} in watch has events not in {list(EVENTS)}")
+    settle = section.get("settle", 0.5)
+    if isinstance(settle, bool) or not isinstance(settle, (int, float)) or settle < 0:
+        raise ValueError(f"{section} in watch has an invalid settle")
+
+
+class PathTrigger:
+    """
+    Submits the jobs of a [[watch]] config section when the files in its
+    paths change, straight onto the queue of the message worker.
+
+    A burst of events triggers once: after the first one, events are gathered
+    until there were none for settle seconds, but for at most ten times that.
+    With recursive, the directories below the paths are watched too,
+    including the ones created later on.
+    """
+
+    # how often the thread checks whether it was stopped
+    POLL = 1
+
+    def __init__(self, section: Dict[str, Any], q: Queue):
+        self.section = section
+        self.q = q
+        self.paths = [Path(path).expanduser() for path in section["paths"]]
+        self.jobs: List[str] = section["jobs"]
+        self.mask = 0
+        for event in section.get("events", DEFAULT_EVENTS):
+            self.mask |= EVENTS[event]
+        self.recursive = section.get("recursive", False)
+        self.settle = section.get("settle", 0.5)
+        self.notification = 0 if section.get("silent", False) else 1
+        self.origin = section.get("origin", "watch")
+        self.stopped = threading.Event()
+        self.logger = logging.getLogger("watch")
+
+    def start(self) -> None:
+        mask = self.mask
+        if self.recursive:
+            # to watch new directories too
+            mask |= inotify.IN_CREATE | inotify.IN_MOVED_TO
+        watcher = inotify.Watcher(mask=mask)
+        for path in self.paths:
+            try:
+                self.add(watcher, path)
+            except OSError as e:
+                self.logger.error(f"not watching {path}: {e}")
+        threading.Thread(target=self.run, args=(watcher,), daemon=True).start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def add(self, watcher: inotify.Watcher, path: Path) -> None:
+        watcher.add(path)
+        if not self.recursive:
+            return
+        for directory, subdirectories, _ in os.walk(path):
+            for subdirectory in subdirectories:
+                try:
+                    watcher.add(Path(directory) / subdirectory)
+                except OSError as e:
+                    self.logger.warning(f"not watching {subdirectory}: {e}")
+
+    def run(self, watcher: inotify.Watcher) -> None:
+        try:
+            while not self.stopped.is_set():
+                if not watcher.wait(self.POLL):
+                    continue
+                triggered = self.matching(watcher, watcher.events())
+                deadline = time.monotonic() + self.settle * 10
+                while time.monotonic() < deadline and watcher.wait(self.settle):
+                    triggered += self.matching(watcher, watcher.events())
+                if triggered and not self.stopped.is_set():
+                    self.logger.info(f"{triggered[0]} changed, triggering {self.jobs}")
+                    self.q.put(
+                        Msg(
+                            action=ActionType.RUN,
+                            jobs=list(self.jobs),
+                            notifications=[self.notification] * len(self.jobs),
+                            origin=self.origin,
+                        )
+                    )
+        finally:
+            watcher.close()
+
+    def matching(
+        self, watcher: inotify.Watcher, events: List[Tuple[Path, int]]
+    ) -> List[Path]:
+        """
+        The paths of the events that trigger the jobs, watching the new
+        directories along the way.
+        """
+        paths = []
+        for path, mask in events:
+            if self.recursive and mask & inotify.IN_ISDIR:
+                if mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+                    try:
+                        self.add(watcher, path)
+                    except OSError as e:
+                        self.logger.warning(f"not watching {path}: {e}")
+            if mask & self.mask:
+                paths.append(path)
+        return paths